@@ -1,22 +1,35 @@
 #!/usr/bin/env python3
 
-import os, sys
+import os, sys, re
 import time
 
-from flask import Flask, request
-from tinydb import TinyDB, where
+from flask import Flask, Response, request, g
 from PM3.model.process import Process
-from PM3.model.pm3_protocol import RetMsg, KillMsg, alive_gone
+from PM3.model.pm3_protocol import RetMsg, KillMsg
 import logging
 from collections import namedtuple
 from configparser import ConfigParser
 import dsnparse
 import psutil
 from pathlib import Path
-from PM3.libs.pm3table import Pm3Table, ION
+from PM3.libs.pm3table import Pm3Table, ION, hidden_proc
+from PM3.libs.pm3store import make_store
+from PM3.libs.reaper import Reaper, wait_procs
+from PM3.libs.logcapture import LogCapture
+from PM3.libs.client import config_socket_path
+from PM3.libs.sampler import Sampler, SAMPLE_ATTRS, PS_ATTRS
+from PM3.libs.proctree import ProcTree
+from PM3.libs.history import MetricsHistory, FIELDS as HISTORY_FIELDS
+from PM3.libs.monitfeed import MonitFeed
+from PM3.libs.events import EventLog, EVENT_TYPES
+from PM3.libs import prometheus, logstream
 import signal
+import socket
 import json
 import threading
+import atexit
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
 
 pm3_home_dir = os.path.expanduser('~/.pm3')
 config_file = f'{pm3_home_dir}/config.ini'
@@ -28,13 +41,31 @@ if not os.path.isfile(config_file):
 config = ConfigParser()
 config.read(config_file)
 
-db = TinyDB(config['main_section'].get('pm3_db'))
-tbl = db.table(config['main_section'].get('pm3_db_process_table'))
-ptbl = Pm3Table(tbl)
+store = make_store(config['main_section'])
+ptbl = Pm3Table(store)
+flush_interval = config['main_section'].getfloat('pm3_db_flush_interval', 1.0)
 
 backend_process_name = config['backend'].get('name') or '__backend__'
 cron_checker_process_name = config['cron_checker'].get('name') or '__cron_checker__'
 
+# Supervisor interno: riavvia subito gli autorun che terminano.
+# Il cron checker esterno resta disponibile come fallback
+supervisor_enabled = config['backend'].getboolean('supervisor', True)
+supervisor_restart_delay = config['backend'].getfloat('supervisor_restart_delay', 0.1)
+supervisor_max_restart_delay = config['backend'].getfloat('supervisor_max_restart_delay', 30)
+supervisor_backoff_reset = config['backend'].getfloat('supervisor_backoff_reset', 10)
+cron_checker_enabled = config['cron_checker'].getboolean('enabled', not supervisor_enabled)
+
+# Operazioni su piu' processi: gli stop attendono tutti insieme (stop_timeout
+# e' il default dei processi senza una propria policy, kill_timeout l'attesa
+# dopo SIGKILL), gli start girano in parallelo su start_concurrency thread
+stop_timeout = config['backend'].getfloat('stop_timeout', 5)
+kill_timeout = config['backend'].getfloat('kill_timeout', 2)
+start_concurrency = config['backend'].getint('start_concurrency', 8)
+
+# Socket unix per cli e cron checker (vuoto: solo tcp)
+unix_socket_path = config_socket_path(config)
+
 app = Flask(__name__)
 
 
@@ -43,6 +74,132 @@ app = Flask(__name__)
 # value = processo Popen
 local_popen_process = {}
 
+# Ultimo exit code dei processi avviati localmente
+# key = pm3_id
+# value = (exit code, timestamp)
+exit_status = {}
+
+# pm3_id in fase di stop: il supervisor non deve riavviarli
+stopping = set()
+# pid fermati da uno stop ma non ancora raccolti dal reaper: la loro
+# uscita e' gia' gestita dallo stop (niente evento exited ne' supervisor)
+stopped_pids = set()
+
+# Avvio (monotonic) e ultimo ritardo di riavvio del supervisor per pm3_id
+_started_at = {}
+_restart_delay = {}
+
+# Protegge local_popen_process, exit_status, stopping, stopped_pids,
+# _started_at e _restart_delay
+popen_lock = threading.Lock()
+
+# Lock per processo: start, stop, reset e supervisor sullo stesso
+# pm3_id sono serializzati, processi diversi procedono in parallelo
+_proc_locks = {}
+_proc_locks_lock = threading.Lock()
+
+def _proc_lock(pm3_id):
+    with _proc_locks_lock:
+        return _proc_locks.setdefault(pm3_id, threading.RLock())
+
+def _current(proc):
+    # Riga aggiornata dal registro: un altro thread puo' averla modificata.
+    # Sempre un Process: chi lo usa lo avvia, lo ferma o lo resetta
+    current = ptbl.get(proc.pm3_id)
+    if current is None:
+        current = proc if isinstance(proc, Process) else proc.to_process()
+    return current
+
+def _refresh(proc):
+    # Trick for update pid (is_running azzera il pid dei processi terminati).
+    # Se e' in corso uno start/stop sul processo restituisco la riga com'e'
+    lock = _proc_lock(proc.pm3_id)
+    if not lock.acquire(blocking=False):
+        return proc
+    try:
+        # Sola lettura: ProcessRecord, niente validazione pydantic per riga
+        proc = ptbl.record(proc.pm3_id) or proc
+        proc.is_running
+        ptbl.update(proc)
+        return proc
+    finally:
+        lock.release()
+
+def _next_restart_delay(pm3_id):
+    # Backoff esponenziale per i processi che escono entro supervisor_backoff_reset
+    # secondi dall'avvio, fino a supervisor_max_restart_delay. Con popen_lock
+    started = _started_at.get(pm3_id)
+    last = _restart_delay.get(pm3_id)
+    if last is None or started is None or time.monotonic() - started >= supervisor_backoff_reset:
+        delay = supervisor_restart_delay
+    else:
+        delay = min(max(last * 2, 0.1), supervisor_max_restart_delay)
+    _restart_delay[pm3_id] = delay
+    return delay
+
+def _on_exit(p, pm3_id):
+    # Chiamata dal reaper appena un processo figlio termina
+    with popen_lock:
+        local_popen_process.pop(p.pid, None)
+        exit_status[pm3_id] = (p.returncode, time.time())
+        if p.pid in stopped_pids:
+            # Fermato da uno stop gia' concluso
+            stopped_pids.discard(p.pid)
+            return
+        if pm3_id in stopping:
+            # Ci pensa lo stop ad aggiornare la riga
+            return
+        delay = _next_restart_delay(pm3_id)
+    logging.info(f'process id={pm3_id} with pid {p.pid} exited with code {p.returncode}')
+    row = ptbl.record(pm3_id)
+    events.emit('exited', pm3_id, row.pm3_name if row else None, pid=p.pid, code=p.returncode)
+
+    with _proc_lock(pm3_id):
+        proc = ptbl.get(pm3_id)
+        if proc is None:
+            return
+        if proc.pid not in (p.pid, -1):
+            # Il processo e' gia' stato riavviato
+            return
+        proc.pid = -1
+        ptbl.update(proc)
+
+    if supervisor_enabled:
+        if delay > 0:
+            threading.Timer(delay, _supervise, args=(pm3_id,)).start()
+        else:
+            _supervise(pm3_id)
+
+def _supervise(pm3_id):
+    with _proc_lock(pm3_id):
+        with popen_lock:
+            if pm3_id in stopping:
+                return
+        proc = ptbl.get(pm3_id)
+        if proc and proc.autorun and not proc.autorun_exclude:
+            ret_m = _resp(_start_process(proc, ION('pm3_id', pm3_id, [proc, ]), event='restarted'))
+            if ret_m['err'] is True:
+                print(ret_m)
+
+reaper = Reaper(on_exit=_on_exit)
+log_capture = LogCapture(max_bytes=int(config['backend'].getfloat('log_max_mb', 10) * 1024 ** 2),
+                         backup_count=config['backend'].getint('log_backups', 5),
+                         flush_interval=config['backend'].getfloat('log_flush_interval', 0.5),
+                         compress=config['backend'].getboolean('log_compress', True),
+                         compress_level=config['backend'].getint('log_compress_level', 6),
+                         max_total_bytes=int(config['backend'].getfloat('log_max_total_mb', 0) * 1024 ** 2),
+                         log_dir=Path(pm3_home_dir, 'log').as_posix())
+sample_interval = config['backend'].getfloat('sample_interval', 2)
+history = MetricsHistory(resolution=config['backend'].getfloat('history_resolution', sample_interval),
+                         size=config['backend'].getint('history_size', 1800),
+                         downsample=config['backend'].getint('history_downsample', 30),
+                         coarse_size=config['backend'].getint('history_coarse_size', 1440),
+                         max_bytes=int(config['backend'].getfloat('history_max_mb', 0) * 1024 ** 2),
+                         fleet=lambda: len(ptbl))
+sampler = Sampler(ptbl.running, interval=sample_interval, on_sample=history.record)
+# Transizioni di stato dei processi per /events
+events = EventLog(size=config['backend'].getint('events_buffer_size', 10000))
+
 def _resp(res: RetMsg) -> dict:
     if res.err:
         logging.error(res.msg)
@@ -51,25 +208,40 @@ def _resp(res: RetMsg) -> dict:
     return res.dict()
 
 def _insert_process(proc: Process, rewrite=False):
+    with ptbl.lock:
+        return _insert_process_locked(proc, rewrite)
+
+def _insert_process_locked(proc: Process, rewrite=False):
     proc.pm3_id = ptbl.next_id() if proc.pm3_id is None else proc.pm3_id
 
-    if tbl.contains(where('pm3_name') == proc.pm3_name):
+    if ptbl.check_exist(proc.pm3_name, col='pm3_name'):
         if not rewrite:
             proc.pm3_name = f'{proc.pm3_name}_{proc.pm3_id}'
 
-    if tbl.contains(where('pm3_id') == proc.pm3_id):
+    if ptbl.check_exist(proc.pm3_id):
         if rewrite:
-            tbl.remove(where('pm3_id') == proc.pm3_id)
-            tbl.insert(proc.dict())
+            owner = ptbl.select(proc, col='pm3_name')
+            if owner and owner['pm3_id'] != proc.pm3_id:
+                return 'NAME_ALREADY_EXIST'
+            ptbl.delete(proc)
+            ptbl.insert(proc)
+            events.emit('edited', proc.pm3_id, proc.pm3_name)
             return 'OK'
         return 'ID_ALREADY_EXIST'
-    elif tbl.contains(where('pm3_name') == proc.pm3_name):
+    elif ptbl.check_exist(proc.pm3_name, col='pm3_name'):
         return 'NAME_ALREADY_EXIST'
     else:
-        tbl.insert(proc.dict())
+        ptbl.insert(proc)
+        events.emit('added', proc.pm3_id, proc.pm3_name)
         return 'OK'
 
-def _start_process(proc, ion) -> RetMsg:
+def _start_process(proc, ion, event='started') -> RetMsg:
+    # event: tipo dell'evento emesso se il processo parte (restarted per
+    # i riavvii del supervisor e di /restart)
+    with _proc_lock(proc.pm3_id):
+        return _start_process_locked(_current(proc), ion, event)
+
+def _start_process_locked(proc, ion, event='started') -> RetMsg:
     if proc.is_running:
         # Already running
         msg = f'process {proc.pm3_name} (id={proc.pm3_id}) already running with pid {proc.pid}'
@@ -80,8 +252,11 @@ def _start_process(proc, ion) -> RetMsg:
         return RetMsg(msg=msg, err=True)
     else:
         try:
-            p = proc.run()
-            local_popen_process[proc.pid] = p
+            p = proc.run(log_capture)
+            with popen_lock:
+                local_popen_process[proc.pid] = p
+                _started_at[proc.pm3_id] = time.monotonic()
+            reaper.register(p, proc.pm3_id)
             if not ptbl.update(proc):
                 # Update Error
                 msg = f'Error updating {proc}'
@@ -93,27 +268,144 @@ def _start_process(proc, ion) -> RetMsg:
             return RetMsg(msg=msg, err=True)
         else:
             # OK, process started
+            events.emit(event, proc.pm3_id, proc.pm3_name, pid=proc.pid, restart=proc.restart)
             msg = f'process {proc.pm3_name} (id={proc.pm3_id}) started with pid {proc.pid}'
             return RetMsg(msg=msg, err=False)
 
+def _start_many(procs, ion, event='started'):
+    # Start in parallelo con al massimo start_concurrency avvii contemporanei,
+    # i risultati restano nell'ordine di procs
+    if len(procs) <= 1 or start_concurrency <= 1:
+        return [_start_process(proc, ion, event) for proc in procs]
+    with ThreadPoolExecutor(max_workers=start_concurrency, thread_name_prefix='pm3_start') as executor:
+        return list(executor.map(lambda proc: _start_process(proc, ion, event), procs))
+
+
+
+# Durata delle richieste http per endpoint (esposta su /metrics)
+request_latency = prometheus.Histogram()
+
+@app.before_request
+def _request_start():
+    g.pm3_t0 = time.perf_counter()
+
+@app.after_request
+def _request_end(response):
+    t0 = g.get('pm3_t0')
+    if t0 is not None:
+        rule = request.url_rule.rule if request.url_rule else 'not_found'
+        request_latency.observe(rule, time.perf_counter() - t0)
+    return response
 
+# Testo delle metriche dei processi, ricalcolato solo quando
+# cambiano il registro o il campione del sampler
+_metrics_cache = {'key': None, 'text': '', 'start_times': []}
 
-def ps_proc_as_dict(ps_proc):
-    '''
-    Versione corretta di psutil.Process().as_dict()
-    La versione originale non aggiorna i valori di CPU
-    :param ps_proc:
-    :return:
-    '''
-    ppad = ps_proc.as_dict()
-    ppad['cpu_percent'] = ps_proc.cpu_percent(interval=0.1)
-    return ppad
+def _process_metrics():
+    key = (ptbl.version, sampler.generation)
+    if _metrics_cache['key'] == key:
+        return _metrics_cache['text'], _metrics_cache['start_times']
+
+    with sampler.lock:
+        snapshot = sampler.snapshot
+    with popen_lock:
+        exits = dict(exit_status)
+
+    m = {k: [] for k in ('restarts', 'max_restart', 'running', 'autorun', 'cpu', 'rss', 'children', 'exit')}
+    start_times = []
+    for row in ptbl.rows():
+        labels = {'pm3_id': row['pm3_id'], 'pm3_name': row['pm3_name']}
+        rows = snapshot.get(row['pm3_id']) if row['pid'] > 0 else None
+        if rows and rows[0]['pid'] != row['pid']:
+            rows = None
+        m['restarts'].append((labels, max(row['restart'], 0)))
+        m['max_restart'].append((labels, row['max_restart']))
+        m['running'].append((labels, bool(rows)))
+        m['autorun'].append((labels, row['autorun'] and not row['autorun_exclude']))
+        if rows:
+            m['cpu'].append((labels, round(sum(r['cpu_percent'] or 0 for r in rows), 2)))
+            m['rss'].append((labels, sum(r['memory_info'][0] for r in rows if r['memory_info'])))
+            m['children'].append((labels, len(rows) - 1))
+            start_times.append((prometheus.format_labels(labels), rows[0]['create_time']))
+        if row['pm3_id'] in exits:
+            m['exit'].append((labels, exits[row['pm3_id']][0]))
+
+    text = ''.join([
+        prometheus.metric('pm3_process_restarts', 'gauge', 'Restarts done by pm3', m['restarts']),
+        prometheus.metric('pm3_process_max_restart', 'gauge', 'Maximum restarts allowed', m['max_restart']),
+        prometheus.metric('pm3_process_running', 'gauge', '1 if the process is running', m['running']),
+        prometheus.metric('pm3_process_autorun', 'gauge', '1 if autorun is enabled', m['autorun']),
+        prometheus.metric('pm3_process_cpu_percent', 'gauge', 'CPU usage of the process tree', m['cpu']),
+        prometheus.metric('pm3_process_rss_bytes', 'gauge', 'Resident memory of the process tree', m['rss']),
+        prometheus.metric('pm3_process_children', 'gauge', 'Number of child processes', m['children']),
+        prometheus.metric('pm3_process_last_exit_code', 'gauge', 'Exit code of the last run', m['exit']),
+    ])
+    _metrics_cache.update(key=key, text=text, start_times=start_times)
+    return text, start_times
+
+@app.get("/metrics")
+def metrics():
+    now = time.time()
+    text, start_times = _process_metrics()
+    uptime = [f'pm3_process_uptime_seconds{labels} {round(now - ct, 3)}' for labels, ct in start_times]
+    stats = ptbl.stats
+    out = [
+        text,
+        '# HELP pm3_process_uptime_seconds Seconds since the process was started\n',
+        '# TYPE pm3_process_uptime_seconds gauge\n',
+        '\n'.join(uptime) + '\n' if uptime else '',
+        prometheus.metric('pm3_http_request_duration_seconds', 'histogram', 'Backend request latency',
+                          request_latency.samples('endpoint')),
+        prometheus.metric('pm3_db_flushes_total', 'counter', 'Database flushes', [({}, stats['flushes'])]),
+        prometheus.metric('pm3_db_flush_errors_total', 'counter', 'Failed database flushes', [({}, stats['flush_errors'])]),
+        prometheus.metric('pm3_db_rows_written_total', 'counter', 'Rows written by flushes', [({}, stats['rows_written'])]),
+        prometheus.metric('pm3_db_rows_deleted_total', 'counter', 'Rows deleted by flushes', [({}, stats['rows_deleted'])]),
+        prometheus.metric('pm3_db_dirty_rows', 'gauge', 'Rows waiting for the next flush', [({}, ptbl.dirty)]),
+        prometheus.metric('pm3_backend_threads', 'gauge', 'Backend threads', [({}, threading.active_count())]),
+        prometheus.metric('pm3_backend_open_fds', 'gauge', 'Backend open file descriptors', [({}, psutil.Process().num_fds())]),
+        prometheus.metric('pm3_log_streams', 'gauge', 'Captured stdout/stderr pipes', [({}, log_capture.streams)]),
+        prometheus.metric('pm3_log_bytes_total', 'counter', 'Log bytes written to disk', [({}, log_capture.stats['bytes'])]),
+        prometheus.metric('pm3_log_rotations_total', 'counter', 'Log file rotations', [({}, log_capture.stats['rotations'])]),
+        prometheus.metric('pm3_log_compressed_total', 'counter', 'Rotated log files compressed', [({}, log_capture.stats['compressed'])]),
+        prometheus.metric('pm3_log_evicted_total', 'counter', 'Rotated log files removed by log_max_total_mb', [({}, log_capture.stats['evicted'])]),
+        prometheus.metric('pm3_events_total', 'counter', 'Process events emitted', [({}, events.stats['emitted'])]),
+        prometheus.metric('pm3_events_dropped_total', 'counter', 'Process events dropped from the events buffer', [({}, events.stats['dropped'])]),
+        prometheus.metric('pm3_sampler_age_seconds', 'gauge', 'Age of the last metrics sample',
+                          [({}, round(now - sampler.sampled_at, 3) if sampler.sampled_at else None)]),
+        prometheus.metric('pm3_history_bytes', 'gauge', 'Memory used by the metrics history', [({}, history.nbytes)]),
+        prometheus.metric('pm3_history_dropped_total', 'counter', 'Samples not kept because the history is full (history_max_mb)',
+                          [({}, history.dropped)]),
+        prometheus.metric('pm3_history_refused_processes', 'gauge', 'Processes without metrics history (history_max_mb)',
+                          [({}, len(history.refused))]),
+    ]
+    return ''.join(out), 200, {'Content-Type': prometheus.CONTENT_TYPE}
 
 @app.get("/ping")
 def pong():
-    payload = {'pid': os.getpid()}
+    me = psutil.Process()
+    payload = {'pid': os.getpid(),
+               'fds': me.num_fds(),
+               'threads': me.num_threads(),
+               'db': {**ptbl.stats, 'dirty': ptbl.dirty},
+               'logs': {**log_capture.stats, 'streams': log_capture.streams},
+               'history': {'bytes': history.nbytes, 'processes': len(history.procs),
+                           'refused': len(history.refused), 'dropped': history.dropped}}
     return _resp(RetMsg(msg='PONG!', err=False, payload=payload))
 
+def _new_result(proc, ret) -> RetMsg:
+    if ret == 'ID_ALREADY_EXIST':
+        msg = f'process with id={proc.pm3_id} already exist'
+        return RetMsg(msg=msg, warn=True)
+    elif ret == 'NAME_ALREADY_EXIST':
+        msg = f'process with name={proc.pm3_name} already exist'
+        return RetMsg(msg=msg, err=True)
+    elif ret == 'OK':
+        msg = f'process [bold]{proc.pm3_name}[/bold] with id={proc.pm3_id} was added'
+        return RetMsg(msg=msg, err=False)
+    else:
+        msg = f'Strange Error :('
+        return RetMsg(msg=msg, err=True)
+
 @app.post("/new")
 @app.post("/new/rewrite")
 def new_process():
@@ -123,48 +415,145 @@ def new_process():
         ret = _insert_process(proc, rewrite=True)
     else:
         ret = _insert_process(proc)
+    return _resp(_new_result(proc, ret))
 
-    if ret == 'ID_ALREADY_EXIST':
-        msg = f'process with id={proc.pm3_id} already exist'
-        return _resp(RetMsg(msg=msg, warn=True))
-    elif ret == 'NAME_ALREADY_EXIST':
-        msg = f'process with name={proc.pm3_name} already exist'
-        return _resp(RetMsg(msg=msg, err=True))
-    elif ret == 'OK':
-        msg = f'process [bold]{proc.pm3_name}[/bold] with id={proc.pm3_id} was added'
-        return _resp(RetMsg(msg=msg, err=False))
+def _bulk_items():
+    # Lista json o json lines (una definizione per riga, anche in streaming).
+    # Una riga json non valida da' l'errore al posto della voce, le altre proseguono
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        for line in request.stream:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError as e:
+                    yield e
     else:
-        msg = f'Strange Error :('
-        return _resp(RetMsg(msg=msg, err=True))
+        items = request.get_json(silent=True)
+        if not isinstance(items, list):
+            raise ValueError('expected a json list or json lines')
+        yield from items
 
+@app.post("/new/bulk")
+@app.post("/new/bulk/rewrite")
+def new_process_bulk():
+    # Come /new per una lista di processi: validazione di tutte le voci,
+    # inserimento con un solo lock del registro (prima le voci con pm3_id,
+    # poi le altre con i primi id liberi), un solo flush su disco.
+    # payload: un RetMsg per voce, nell'ordine ricevuto
+    rewrite = request.path.endswith('/rewrite')
+    try:
+        items = list(_bulk_items())
+    except (ValueError, TypeError) as e:
+        return _resp(RetMsg(msg=f'invalid bulk request: {e}', err=True))
+    results = [None] * len(items)
+    procs = []
+    for n, item in enumerate(items):
+        if isinstance(item, ValueError):
+            results[n] = RetMsg(msg=f'invalid process #{n}: {item}', err=True)
+            continue
+        try:
+            procs.append((n, Process(**item)))
+        except (ValueError, TypeError) as e:
+            results[n] = RetMsg(msg=f'invalid process #{n}: {e}', err=True)
 
-def _local_kill(proc ):
-    p : Process = local_popen_process[proc.pid]
-    local_pid = p.pid
-    #p.kill()
-    Process.kill_proc_tree(local_pid)
-    for i in range(5):
-        _ = p.poll()
-        if not proc.is_running:
-            break
-        time.sleep(1)
-    else:
-        return KillMsg(msg='OK', alive=[alive_gone(pid=local_pid),], warn=True)
-    # Elimino l'elemento dal dizionario
-    _ = local_popen_process.pop(local_pid, None)
-    return KillMsg(msg='OK', gone=[alive_gone(pid=local_pid), ])
-
-def _interal_poll():
-    for local_pid, p in local_popen_process.items():
-        p.poll()
-
-def _interal_poll_thread():
-    # Interrogazione ciclica dei processi avviati da PM3
-    # i processi contenuti in local_popen_process
-    # vanno periodicamente interrogati
+    with ptbl.lock:
+        for n, proc in sorted(procs, key=lambda i: i[1].pm3_id is None):
+            results[n] = _new_result(proc, _insert_process_locked(proc, rewrite))
+    try:
+        ptbl.flush()
+    except Exception as e:
+        # Le righe restano dirty: le riscrive il flush periodico
+        logging.error(f'db flush error: {e}')
+
+    added = sum(1 for r in results if not r.err and not r.warn)
+    failed = sum(1 for r in results if r.err)
+    msg = f'{added}/{len(items)} processes added, {failed} errors'
+    return _resp(RetMsg(msg=msg, warn=failed > 0, payload=[r.dict() for r in results]))
+
+
+def _kill_many(procs, tree=None):
+    # Stop di piu' processi insieme, ognuno con la sua policy:
+    # stop_signal a tutti gli alberi, attesa sui pidfd (ritorna appena
+    # escono) fino a stop_timeout, poi SIGKILL ai superstiti se stop_kill.
+    # Restituisce {pm3_id: KillMsg}
+    rets = {}
+    signalled = {}      # pm3_id -> [psutil.Process]
+    t0 = time.monotonic()
+    for proc in procs:
+        if proc.pid == -1:
+            rets[proc.pm3_id] = KillMsg(msg='NOT RUNNING', warn=True)
+            continue
+        try:
+            signalled[proc.pm3_id] = Process.signal_proc_tree(proc.pid, sig=proc.stop_signum, tree=tree)
+        except psutil.NoSuchProcess:
+            rets[proc.pm3_id] = KillMsg(msg='NO SUCH PROCESS', warn=True)
+
+    policy = {proc.pm3_id: proc for proc in procs}
+    deadline = {i: t0 + (policy[i].stop_timeout if policy[i].stop_timeout is not None else stop_timeout)
+                for i in signalled}
+    waiting = {p: i for i, children in signalled.items() for p in children}
+    last_exit = dict.fromkeys(signalled, t0)
+    killed = set()
+    given_up = set()
+
+    def _on_exit(p):
+        i = waiting.pop(p)
+        last_exit[i] = time.monotonic()
+
+    while waiting:
+        next_deadline = min(deadline[i] for i in set(waiting.values()))
+        wait_procs(list(waiting), timeout=max(0, next_deadline - time.monotonic()), callback=_on_exit)
+        now = time.monotonic()
+        for i in {i for i in waiting.values() if deadline[i] <= now}:
+            alive = [p for p, j in waiting.items() if j == i]
+            if i in killed or not policy[i].stop_kill:
+                # Non aspetto oltre: restano vivi
+                given_up.update(alive)
+                for p in alive:
+                    del waiting[p]
+                continue
+            # Escalation a SIGKILL
+            for p in alive:
+                try:
+                    p.kill()
+                except psutil.NoSuchProcess:
+                    pass
+            killed.add(i)
+            deadline[i] = now + kill_timeout
+
+    for proc in procs:
+        if proc.pm3_id not in signalled:
+            continue
+        still_alive = [p for p in signalled[proc.pm3_id] if p in given_up]
+        gone = [p for p in signalled[proc.pm3_id] if p not in given_up]
+        is_killed = proc.pm3_id in killed
+        if still_alive:
+            rets[proc.pm3_id] = KillMsg(msg='OK', alive=still_alive, gone=gone, warn=True, killed=is_killed)
+            continue
+        # Processi attivati da os.getpid(): elimino il Popen dal dizionario.
+        # Se c'era ancora il reaper non ha raccolto l'uscita: la segno come
+        # gia' gestita, anche se arriva dopo la fine dello stop
+        with popen_lock:
+            if local_popen_process.pop(proc.pid, None) is not None:
+                stopped_pids.add(proc.pid)
+        proc.pid = -1
+        rets[proc.pm3_id] = KillMsg(msg='OK', gone=gone, killed=is_killed,
+                                    elapsed=round(last_exit[proc.pm3_id] - t0, 4))
+    return rets
+
+def _flush_thread():
+    # Scrittura differita del db: solo le righe modificate,
+    # raggruppate in un unico flush ogni flush_interval secondi
     while True:
-        _interal_poll()
-        time.sleep(1)
+        time.sleep(flush_interval)
+        try:
+            ptbl.flush()
+        except Exception as e:
+            logging.error(f'db flush error: {e}')
+
+def _shutdown(signum, frame):
+    # SystemExit esegue gli handler di atexit (flush finale del db)
+    sys.exit(0)
 
 @app.get("/stop/<id_or_name>")
 @app.get("/restart/<id_or_name>")
@@ -177,88 +566,370 @@ def stop_and_rm_process(id_or_name):
         msg = f'process {ion.type}={ion.data} not found'
         resp_list.append(_resp(RetMsg(msg=msg, err=True)))
 
-    for proc in ion.proc:
-        if proc.pid in local_popen_process:
-            # Processi attivati da os.getpid() vanno trattati con popen
-            ret = _local_kill(proc)
-            logging.debug('local kill')
-        else:
-            ret = proc.kill()
-            logging.debug('simple kill')
+    # Una sola scansione di /proc per tutti i processi da fermare
+    tree = ProcTree() if ion.proc else None
+    pm3_ids = sorted({proc.pm3_id for proc in ion.proc})
+    with popen_lock:
+        stopping.update(pm3_ids)
+    try:
+        with ExitStack() as stack:
+            # Lock sempre in ordine di pm3_id: nessun deadlock tra stop concorrenti
+            for pm3_id in pm3_ids:
+                stack.enter_context(_proc_lock(pm3_id))
+            procs = [_current(proc) for proc in ion.proc]
+            rets = _kill_many(procs, tree)
+            for proc in procs:
+                resp_list += _stop_and_rm_process(proc, rets[proc.pm3_id],
+                                                  remove=request.path.startswith('/rm/'))
+    finally:
+        with popen_lock:
+            stopping.difference_update(pm3_ids)
 
-        if ret.msg == 'OK':
-            proc.autorun_exclude = True
-            ptbl.update(proc)
-            for pk in ret.gone:
-                msg = f'process {proc.pm3_name} (id={proc.pm3_id}) with pid {pk.pid} was killed'
-                resp_list.append(_resp(RetMsg(msg=msg, err=False)))
-        elif ret.warn:
-            for pk in ret.alive:
-                msg = f'process {proc.pm3_name} (id={proc.pm3_id}) with pid {pk.pid} still alive'
-                resp_list.append(_resp(RetMsg(msg=msg, warn=True)))
-            if ret.alive == 0:
-                msg = f'process {proc.pm3_name} (id={proc.pm3_id}) not running'
-                resp_list.append(_resp(RetMsg(msg=msg, warn=True)))
-        else:
-            msg = f'Strange Error'
+    if request.path.startswith('/restart/'):
+        resp_list += _start_by_name(id_or_name, event='restarted')['payload']
+
+    return _resp(RetMsg(msg='', payload=resp_list))
+
+def _stop_and_rm_process(proc, ret, remove=False):
+    # ret: KillMsg di _kill_many per questo processo
+    resp_list = []
+    if ret.msg == 'OK':
+        proc.autorun_exclude = True
+        ptbl.update(proc)
+        for pk in ret.alive:
+            msg = f'process {proc.pm3_name} (id={proc.pm3_id}) with pid {pk.pid} still alive'
             resp_list.append(_resp(RetMsg(msg=msg, warn=True)))
+        if not ret.alive:
+            # Il processo principale e' l'ultimo segnalato, dopo i figli
+            pid = ret.gone[-1].pid
+            how = 'SIGKILL' if ret.killed else proc.stop_signal
+            msg = f'process {proc.pm3_name} (id={proc.pm3_id}) with pid {pid} stopped by {how} in {ret.elapsed * 1000:.0f} ms'
+            if len(ret.gone) > 1:
+                msg += f' ({len(ret.gone) - 1} children)'
+            payload = {'pm3_id': proc.pm3_id, 'pids': [pk.pid for pk in ret.gone],
+                       'signal': proc.stop_signal, 'killed': ret.killed, 'stop_time': ret.elapsed}
+            events.emit('stopped', proc.pm3_id, proc.pm3_name, pid=pid, signal=how,
+                        stop_time=round(ret.elapsed, 3))
+            resp_list.append(_resp(RetMsg(msg=msg, warn=ret.killed, payload=payload)))
+    elif ret.warn:
+        for pk in ret.alive:
+            msg = f'process {proc.pm3_name} (id={proc.pm3_id}) with pid {pk.pid} still alive'
+            resp_list.append(_resp(RetMsg(msg=msg, warn=True)))
+        if ret.alive == 0:
+            msg = f'process {proc.pm3_name} (id={proc.pm3_id}) not running'
+            resp_list.append(_resp(RetMsg(msg=msg, warn=True)))
+    else:
+        msg = f'Strange Error'
+        resp_list.append(_resp(RetMsg(msg=msg, warn=True)))
 
-        if request.path.startswith('/rm/'):
-            if not ptbl.delete(proc):
-                msg = f'Error updating {proc}'
-                resp_list.append(_resp(RetMsg(msg=msg, err=True)))
-            else:
-                msg = f'process {proc.pm3_name} (id={proc.pm3_id}) removed'
-                resp_list.append(_resp(RetMsg(msg=msg, err=False)))
+    if remove:
+        if not ptbl.delete(proc):
+            msg = f'Error updating {proc}'
+            resp_list.append(_resp(RetMsg(msg=msg, err=True)))
+        else:
+            history.forget(proc.pm3_id)
+            events.emit('removed', proc.pm3_id, proc.pm3_name)
+            msg = f'process {proc.pm3_name} (id={proc.pm3_id}) removed'
+            resp_list.append(_resp(RetMsg(msg=msg, err=False)))
+    return resp_list
 
-    if request.path.startswith('/restart/'):
-        resp_list += start_process(id_or_name)['payload']
+# ETag di /ls e /ps: cambiano con il registro (ptbl.version), con i processi
+# vivi (sampler.liveness, /ls) o con ogni campione (sampler.generation, /ps).
+# L'epoca distingue i contatori di backend diversi
+_etag_epoch = f'{os.getpid():x}.{int(time.time()):x}'
 
-    return _resp(RetMsg(msg='', payload=resp_list))
+def _etag(kind):
+    if kind == 'ls':
+        return f'W/"ls.{_etag_epoch}.{ptbl.version}.{sampler.liveness}"'
+    return f'W/"ps.{_etag_epoch}.{ptbl.version}.{sampler.generation}"'
+
+def _not_modified(etag):
+    # 304 se il client ha gia' questa versione: nessun lavoro e niente json
+    tags = request.headers.get('If-None-Match')
+    if tags and etag in (t.strip() for t in tags.split(',')):
+        return Response(status=304, headers={'ETag': etag})
+    return None
 
 @app.get("/ls/<id_or_name>")
 def ls_process(id_or_name):
+    # ETag letto prima di costruire la risposta: i dati sono almeno nuovi quanto lui
+    etag = _etag('ls')
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
     payload = []
     ion = ptbl.find_id_or_name(id_or_name)
     for proc in ion.proc:
-        # Aggiorno lo stato dei processi
-        _interal_poll()
-        # Trick for update pid
-        proc.is_running
-        ptbl.update(proc)
-        payload.append(proc)
-    return RetMsg(msg='OK', err=False, payload=payload).dict()
+        payload.append(_refresh(proc).dict())
+    return RetMsg(msg='OK', err=False, payload=payload).dict(), {'ETag': etag}
 
 @app.get("/ps/<id_or_name>")
 def pstatus(id_or_name):
+    # fields (opzionale): campi separati da virgola, tra quelli del processo,
+    # gli attributi psutil (PS_ATTRS) e sample_age. Vengono raccolti e
+    # restituiti solo quelli. Gli attributi non campionati sono letti ora:
+    # senza fields (formato completo) tutti, con fields solo quelli chiesti
+    fields = [f for f in request.args.get('fields', '').split(',') if f] or None
+    if fields:
+        unknown = set(fields).difference(Process.__fields__, PS_ATTRS, ('sample_age',))
+        if unknown:
+            return _resp(RetMsg(msg=f"unknown fields: {', '.join(sorted(unknown))}", err=True))
+        # Sempre almeno pid: as_dict(attrs=[]) raccoglierebbe tutto
+        attrs = ['pid'] + [f for f in fields if f in PS_ATTRS and f != 'pid']
+        extra = [a for a in attrs if a not in SAMPLE_ATTRS]
+    else:
+        extra = sorted(PS_ATTRS.difference(SAMPLE_ATTRS))
+        attrs = SAMPLE_ATTRS + extra
+
+    etag = _etag('ps')
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
     procs = []
     ion = ptbl.find_id_or_name(id_or_name)
     for proc in ion.proc:
-        # Trick for update pid
-        proc.is_running
-        if id_or_name == 0 and proc.pid != os.getpid():
-            proc.pid = os.getpid()
-        ptbl.update(proc)  # Aggiorno anche il database
-        procs.append(proc)
+        procs.append(_refresh(proc))
 
     payload = []
+    tree = None
     for proc in procs:
         if proc.pid > 0:
-            payload.append({**proc.dict(), **ps_proc_as_dict(psutil.Process(proc.pid))})
+            # Processo e figli dall'ultimo campione del sampler
+            rows, sample_age = sampler.get(proc.pm3_id, proc.pid)
+            if rows is None:
+                # Non ancora campionato: una sola scansione di /proc per tutta la richiesta
+                # e solo gli attributi richiesti
+                tree = tree or ProcTree()
+                rows, sample_age = sampler.sample_tree(proc.pid, tree, attrs=attrs), 0.0
+            elif extra:
+                rows = sampler.collect(rows, extra)
+            if fields:
+                base = {f: getattr(proc, f) for f in fields if f in Process.__fields__}
+            else:
+                base = proc.dict()
+            for row in rows:
+                item = {**base, **row, 'sample_age': round(sample_age, 3)}
+                payload.append({f: item[f] for f in fields if f in item} if fields else item)
+
+    return _resp(RetMsg(msg='OK', err=False, payload=payload)), {'ETag': etag}
+
+def _monit_rows():
+    # Una riga per processo (nascosti esclusi) con le metriche dell'albero
+    # sommate; valori arrotondati: righe uguali non vengono rispedite
+    with sampler.lock:
+        snapshot = sampler.snapshot
+    out = {}
+    for row in ptbl.rows():
+        if hidden_proc(row['pm3_name']):
+            continue
+        rows = snapshot.get(row['pm3_id']) if row['pid'] > 0 else None
+        if rows and rows[0]['pid'] != row['pid']:
+            rows = None
+        if row['autorun'] is False:
+            autorun = 'disabled'
+        else:
+            autorun = 'suspended' if row['autorun_exclude'] else 'enabled'
+        m = {'pm3_id': row['pm3_id'], 'pm3_name': row['pm3_name'],
+             'pid': row['pid'] if row['pid'] > 0 else None,
+             'status': 'stopped', 'cpu': 0.0, 'mem': 0.0, 'rss': 0, 'threads': 0, 'children': 0,
+             'create_time': None, 'restart': max(row['restart'], 0), 'autorun': autorun}
+        if rows:
+            m.update(status=rows[0]['status'],
+                     cpu=round(sum(r['cpu_percent'] or 0 for r in rows), 1),
+                     mem=round(sum(r['memory_percent'] or 0 for r in rows), 1),
+                     rss=sum(r['memory_info'][0] for r in rows if r['memory_info']),
+                     threads=sum(r['num_threads'] or 0 for r in rows),
+                     children=len(rows) - 1,
+                     create_time=rows[0]['create_time'])
+        elif row['pid'] > 0:
+            # Avviato ma non ancora campionato
+            m['status'] = 'starting'
+        out[row['pm3_id']] = m
+    return out
+
+monit_feed = MonitFeed(_monit_rows, lambda: (ptbl.version, sampler.generation))
+monit_clients = threading.BoundedSemaphore(config['backend'].getint('monit_max_clients', 2))
+
+@app.get("/monit")
+def monit():
+    # pm3 monit (SSE): alla connessione tutte le righe, poi solo quelle cambiate.
+    # since: ultima generazione ricevuta (riconnessione), interval: secondi tra i controlli
+    since = request.args.get('since', 0, type=int)
+    interval = max(request.args.get('interval', 1, type=float), 0.2)
+    if not monit_clients.acquire(blocking=False):
+        return _resp(RetMsg(msg='too many monit clients, retry later', err=True)), 503
+
+    def generate():
+        last, idle = since, 0
+        while True:
+            monit_feed.update()
+            delta = monit_feed.delta(last)
+            if delta['full'] or delta['rows'] or delta['removed']:
+                last, idle = delta['gen'], 0
+                yield f'data: {json.dumps(delta)}\n\n'
+            else:
+                idle += interval
+                if idle >= 5:
+                    # Scopre i client che se ne sono andati
+                    idle = 0
+                    yield ': keepalive\n\n'
+            time.sleep(interval)
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.call_on_close(monit_clients.release)
+    return response
+
+# Client in attesa su /events (long-poll o SSE): ognuno occupa un thread del server
+event_clients = threading.BoundedSemaphore(
+    config['backend'].getint('events_max_clients', max(1, config['backend'].getint('server_threads', 8) // 4)))
+
+@app.get("/events")
+def events_feed():
+    # Eventi con seq > since (default: da adesso). wait: secondi di attesa se
+    # non ce ne sono (long-poll, max 60), types: tipi separati da virgola,
+    # limit: eventi per risposta. Con Accept: text/event-stream resta in
+    # ascolto (SSE, riparte da Last-Event-ID)
+    sse = 'text/event-stream' in request.headers.get('Accept', '')
+    since = request.headers.get('Last-Event-ID', type=int) if sse else None
+    if since is None:
+        since = request.args.get('since', events.seq, type=int)
+    wait = min(max(request.args.get('wait', 0, type=float), 0), 60)
+    limit = max(request.args.get('limit', 1000, type=int), 1)
+    types = request.args.get('types')
+    if types:
+        types = set(types.split(','))
+        unknown = types.difference(EVENT_TYPES)
+        if unknown:
+            return _resp(RetMsg(msg=f"unknown event types: {', '.join(sorted(unknown))}", err=True))
+
+    if not sse and not wait:
+        found, missed, last = events.since(since, types, limit)
+        return _resp(RetMsg(msg='OK', payload={'last': last, 'missed': missed, 'events': found}))
+
+    if not event_clients.acquire(blocking=False):
+        return _resp(RetMsg(msg='too many event clients, retry later', err=True)), 503
+    if not sse:
+        try:
+            found, missed, last = events.wait(since, wait, types, limit)
+        finally:
+            event_clients.release()
+        return _resp(RetMsg(msg='OK', payload={'last': last, 'missed': missed, 'events': found}))
+
+    def generate():
+        seq = since
+        while True:
+            found, missed, last = events.wait(seq, 5, types, limit)
+            if missed:
+                yield f'event: missed\ndata: {json.dumps({"last": last})}\n\n'
+            if found:
+                yield ''.join(f'id: {e["seq"]}\ndata: {json.dumps(e)}\n\n' for e in found)
+            elif not missed:
+                # Scopre i client che se ne sono andati
+                yield ': keepalive\n\n'
+            seq = last
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.call_on_close(event_clients.release)
+    return response
 
-            # Children process
-            for ps_proc in psutil.Process(proc.pid).children(recursive=True):
-                payload.append({**proc.dict(), **ps_proc_as_dict(ps_proc)})
+@app.get("/metrics/history/<id_or_name>")
+def metrics_history(id_or_name):
+    # since: timestamp (o secondi fa se negativo), step: secondi per punto
+    since = request.args.get('since', 0, type=float)
+    step = request.args.get('step', 0, type=float)
+    if since < 0:
+        since = time.time() + since
 
+    payload = []
+    ion = ptbl.find_id_or_name(id_or_name)
+    for proc in ion.proc:
+        # retained=False: nessuno storico per questo processo, history_max_mb pieno
+        points = history.query(proc.pm3_id, since, step)
+        payload.append({'pm3_id': proc.pm3_id,
+                        'pm3_name': proc.pm3_name,
+                        'fields': ['ts', *HISTORY_FIELDS],
+                        'retained': points is not None,
+                        'points': points or []})
     return _resp(RetMsg(msg='OK', err=False, payload=payload))
 
+# Client in follow sui log: ognuno occupa un thread del server per tutta la durata
+log_followers = threading.BoundedSemaphore(
+    config['backend'].getint('log_max_followers', max(1, config['backend'].getint('server_threads', 8) // 2)))
+
+@app.get("/logs/<id_or_name>")
+def logs(id_or_name):
+    # lines: ultime righe di ogni file, follow=1: resta in ascolto delle nuove righe,
+    # stream: out, err o all. Con Accept: text/event-stream risponde in SSE.
+    # grep (regex), since, until (timestamp), ignore_case=1: ricerca nei log
+    # e nei file ruotati invece del tail
+    lines = request.args.get('lines', 10, type=int)
+    follow = request.args.get('follow', 0, type=int) == 1
+    which = request.args.get('stream', 'all')
+    grep = request.args.get('grep')
+    since = request.args.get('since', type=float)
+    until = request.args.get('until', type=float)
+    ignore_case = request.args.get('ignore_case', 0, type=int) == 1
+    searching = grep is not None or since is not None or until is not None
+    follow = follow and not searching
+    sse = 'text/event-stream' in request.headers.get('Accept', '')
+
+    ion = ptbl.find_id_or_name(id_or_name)
+    if len(ion.proc) == 0:
+        msg = f'process {ion.type}={ion.data} not found'
+        return _resp(RetMsg(msg=msg, err=True))
+    sources = []
+    for proc in ion.proc:
+        if which in ('out', 'all'):
+            sources.append((f'{proc.pm3_id}|{proc.pm3_name}|out| ', proc.stdout))
+        if which in ('err', 'all'):
+            sources.append((f'{proc.pm3_id}|{proc.pm3_name}|err| ', proc.stderr))
+
+    if grep:
+        try:
+            re.compile(grep)
+        except re.error as e:
+            return _resp(RetMsg(msg=f'invalid grep pattern: {e}', err=True))
+
+    if follow and not log_followers.acquire(blocking=False):
+        return _resp(RetMsg(msg='too many log followers, retry later', err=True)), 503
+
+    def generate():
+        # Il generatore si ferma quando il client non legge (coda di invio
+        # piena): le righe restano su disco, non in memoria
+        if searching:
+            blocks = logstream.search(sources, grep, since, until, ignore_case)
+        else:
+            blocks = logstream.stream(sources, lines=lines, follow=follow)
+        for block in blocks:
+            if sse:
+                if not block:
+                    yield ': keepalive\n\n'
+                    continue
+                yield ''.join('data: ' + line.rstrip('\n').replace('\r', '') + '\n\n' for line in block)
+            elif block:
+                yield ''.join(block)
+
+    response = Response(generate(), mimetype='text/event-stream' if sse else 'text/plain')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    if follow:
+        response.call_on_close(log_followers.release)
+    return response
+
 @app.get("/reset/<id_or_name>")
 def reset(id_or_name):
     resp_list = []
     ion = ptbl.find_id_or_name(id_or_name)
     for proc in ion.proc:
-        proc.reset()
-        if not ptbl.update(proc):
+        with _proc_lock(proc.pm3_id):
+            proc = _current(proc)
+            proc.reset()
+            updated = ptbl.update(proc)
+        if not updated:
             msg = f'Error updating {proc}'
             resp_list.append(_resp(RetMsg(msg=msg, err=True)))
         else:
@@ -268,14 +939,17 @@ def reset(id_or_name):
 
 @app.get("/start/<id_or_name>")
 def start_process(id_or_name):
+    return _start_by_name(id_or_name)
+
+def _start_by_name(id_or_name, event='started'):
     resp_list = []
     ion = ptbl.find_id_or_name(id_or_name)
     if len(ion.proc) == 0:
         msg = f'process {ion.type}={ion.data} not found'
         resp_list.append(_resp(RetMsg(msg=msg, err=True)))
 
-    for proc in ion.proc:
-        resp_list.append(_resp(_start_process(proc, ion)))
+    for ret in _start_many(ion.proc, ion, event):
+        resp_list.append(_resp(ret))
     return _resp(RetMsg(msg='', payload=resp_list))
 
 def _make_fake_backend(pid, cwd):
@@ -307,6 +981,108 @@ def _make_cron_checker():
     return proc
 
 
+def _remove_unix_socket(path, ino):
+    # Solo se e' ancora il mio (un nuovo backend puo' averlo ricreato)
+    try:
+        if os.stat(path).st_ino == ino:
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def _unix_socket(path):
+    # Socket unix dell'utente (permessi 0600), oltre all'url tcp
+    if os.path.exists(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except OSError:
+            # Lasciato da un backend terminato
+            os.remove(path)
+        else:
+            logging.error(f'unix socket {path} already in use, listening on tcp only')
+            return None
+        finally:
+            probe.close()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    os.chmod(path, 0o600)
+    atexit.register(_remove_unix_socket, path, os.stat(path).st_ino)
+    return sock
+
+def _serve(dsn):
+    # server = production: waitress con un pool limitato di worker,
+    # keep-alive e timeout sulle connessioni inattive, in ascolto
+    # sull'url tcp e sul socket unix [backend] socket.
+    # server = development: il server di sviluppo di Flask, solo tcp
+    server = config['backend'].get('server', 'production')
+    if server == 'production':
+        try:
+            from waitress.server import create_server
+            from waitress.channel import HTTPChannel
+            from waitress.task import ThreadedTaskDispatcher, WSGITask
+        except ImportError:
+            logging.warning('waitress is not installed, using the development server')
+        else:
+            class KeepAliveTask(WSGITask):
+                # waitress chiude la connessione di ogni risposta HTTP/1.1 senza
+                # Content-Length, anche dei 304 che un corpo non lo hanno mai
+                # (e il Content-Length non lo possono avere): per loro la
+                # connessione resta in keep-alive, come per i 200
+                _building_header = False
+
+                def build_response_header(self):
+                    self._building_header = True
+                    try:
+                        return super().build_response_header()
+                    finally:
+                        self._building_header = False
+
+                def set_close_on_finish(self):
+                    if (self._building_header and not self.has_body and self.version == '1.1'
+                            and self.request.headers.get('CONNECTION', '').lower() != 'close'):
+                        return
+                    super().set_close_on_finish()
+
+            class KeepAliveChannel(HTTPChannel):
+                task_class = KeepAliveTask
+
+            threads = config['backend'].getint('server_threads', 8)
+            sockets = [socket.create_server((dsn.host, dsn.port))]
+            if unix_socket_path:
+                try:
+                    unix_sock = _unix_socket(unix_socket_path)
+                except OSError as e:
+                    logging.error(f'unix socket {unix_socket_path}: {e}')
+                    unix_sock = None
+                if unix_sock is not None:
+                    sockets.append(unix_sock)
+            # waitress non mescola socket tcp e unix nello stesso server:
+            # un server per socket, stesso loop (map) e stesso pool di worker
+            dispatcher = ThreadedTaskDispatcher()
+            dispatcher.set_thread_count(threads)
+            socket_map = {}
+            servers = [create_server(app,
+                                     map=socket_map,
+                                     _dispatcher=dispatcher,
+                                     sockets=[sock],
+                                     threads=threads,
+                                     connection_limit=config['backend'].getint('server_connection_limit', 100),
+                                     channel_timeout=config['backend'].getint('server_timeout', 30),
+                                     # Con piu' di 1 MB in coda verso un client lento (log in follow)
+                                     # il thread che genera la risposta si ferma
+                                     outbuf_high_watermark=1024 ** 2,
+                                     # poll invece di select: con migliaia di processi le pipe
+                                     # dei log portano i descrittori oltre FD_SETSIZE (1024)
+                                     asyncore_use_poll=True,
+                                     ident='pm3')
+                       for sock in sockets]
+            for srv in servers:
+                srv.channel_class = KeepAliveChannel
+                srv.print_listen('Serving on http://{}:{}')
+            servers[0].run()
+            return
+    app.run(debug=False, use_reloader=False, host=dsn.host, port=dsn.port, threaded=True)
+
 def main():
     my_pid = os.getpid()
     my_cwd = os.getcwd()
@@ -336,24 +1112,51 @@ def main():
     else:
         proc_cron = ion_cron.proc[0]
 
-    ret_m = _resp(_start_process(proc_cron, ion_cron))
-    if ret_m['err'] is True:
-        print(ret_m)
+    # Cattura dei log attiva prima di avviare qualsiasi processo
+    log_capture.start()
+    atexit.register(log_capture.flush)
+    log_capture.compress_leftovers([(row[stream], row['log_compress']) for row in ptbl.rows() if not row['nohup']
+                                    for stream in ('stdout', 'stderr')])
+
+    # Processi sopravvissuti a un backend precedente (es. --nohup): non sono
+    # figli, ma il reaper ne segue l'uscita via pidfd e il supervisor li riavvia
+    for pm3_id, pid in ptbl.running():
+        if pid == my_pid:
+            continue
+        proc = ptbl.get(pm3_id)
+        if not proc.is_running:
+            ptbl.update(proc)
+            continue
+        with popen_lock:
+            try:
+                local_popen_process[proc.pid] = reaper.adopt(proc.pid, pm3_id)
+            except psutil.NoSuchProcess:
+                continue
+            _started_at[pm3_id] = time.monotonic()
+        logging.info(f'process id={pm3_id} with pid {proc.pid} adopted')
+
+    if cron_checker_enabled:
+        ret_m = _resp(_start_process(proc_cron, ion_cron))
+        if ret_m['err'] is True:
+            print(ret_m)
 
     # Autorun
     ion = ptbl.find_id_or_name('autorun_enabled')
-    for proc in ion.proc:
-        proc.is_running
-        ret_m = _resp(_start_process(proc, ion))
+    for ret in _start_many(ion.proc, ion):
+        ret_m = _resp(ret)
         if ret_m['err'] is True:
             print(ret_m)
 
     # Threads
-    t1 = threading.Thread(target=_interal_poll_thread)
-    t1.start()
+    reaper.start()
+    sampler.start()
+    t2 = threading.Thread(target=_flush_thread, daemon=True)
+    t2.start()
+    atexit.register(ptbl.flush)
+    signal.signal(signal.SIGTERM, _shutdown)
 
     print(f'running on pid: {my_pid}')
-    app.run(debug=False, use_reloader=False, host=dsn.host, port=dsn.port)
+    _serve(dsn)
     # il reloader non fa ricaricare correttamente il backend! perchè ci sono i threads
     # ricaricare a mano
 
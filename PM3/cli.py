@@ -3,31 +3,23 @@ import json
 import sys
 import shutil
 import time
-import requests
-import argparse, argcomplete
+import argparse
 import logging
-from PM3.model.process import Process, ProcessStatus, ProcessStatusLight, ProcessList
-from PM3.model.pm3_protocol import RetMsg
-from PM3.libs.system_scripts import pm3_scripts
+from functools import lru_cache
+from PM3.libs.client import Client, BackendError, config_socket_path
 from rich import print
-from rich.table import Table
-from rich.console import Console
 import os, signal
 from pathlib import Path
 from configparser import ConfigParser
-import psutil
-import asyncio
-from pytailer import async_fail_tail
 import getpass
 
+# I moduli pesanti (rich.table, psutil, pendulum, modelli dei processi, ...)
+# sono importati solo nei comandi che li usano: pm3 ls e pm3 ping vengono
+# lanciati spesso da script e prompt (python -m benchmarks.bench_startup)
+
 logging.basicConfig(level=logging.WARNING)
 logger = logging.getLogger()
 
-async def tailfile(f, lines=10):
-    with async_fail_tail(f, lines=lines) as tail:
-        async for line in tail:  # be careful: infinite loop!
-            print(line, end='', flush=True)
-
 def _clean_ls_proc(p: dict) -> dict:
     p.pop('pid')
     p.pop('restart')
@@ -35,6 +27,7 @@ def _clean_ls_proc(p: dict) -> dict:
     return p
 
 def _setup():
+    import psutil
     pm3_home_dir = Path('~/.pm3').expanduser()
     config_file = f'{pm3_home_dir}/config.ini'
     Path(pm3_home_dir).mkdir(mode=0o755, exist_ok=True)
@@ -55,25 +48,48 @@ def _setup():
         tcp_port = os.geteuid() + 6979
         config['main_section'] = {
             'pm3_home_dir': pm3_home_dir,
+            'pm3_db_engine': 'tinydb',
             'pm3_db': f'{pm3_home_dir}/pm3_db.json',
+            'pm3_db_sqlite': f'{pm3_home_dir}/pm3_db.sqlite',
             'pm3_db_process_table': 'pm3_procs',
+            'pm3_db_flush_interval': 1,
             'main_interpreter': exe,
         }
         config['backend'] = {
             'name': '__backend__',
             'cmd': cmd_backend,
             'url': f'http://127.0.0.1:{tcp_port}/',
+            'socket': f'{pm3_home_dir}/pm3.sock',
+            'server': 'production',
+            'server_threads': 8,
+            'server_timeout': 30,
+            'supervisor': True,
+            'supervisor_restart_delay': 0.1,
+            'supervisor_max_restart_delay': 30,
+            'stop_timeout': 5,
+            'kill_timeout': 2,
+            'start_concurrency': 8,
+            'sample_interval': 2,
+            'history_size': 1800,
+            'history_max_mb': 0,
+            'log_max_mb': 10,
+            'log_backups': 5,
+            'log_compress': True,
+            'log_max_total_mb': 0,
         }
         config['cron_checker'] = {
             'name': '__cron_checker__',
             'cmd': cmd_cron_checker,
+            'enabled': False,
             'sleep_time': 5,
             'debug': False
         }
         with open(config_file, 'w') as output_file:
             config.write(output_file)
 
+@lru_cache(maxsize=None)
 def _read_config():
+    # Letto una sola volta per comando
     pm3_home_dir = Path('~/.pm3').expanduser()
     config_file = f'{pm3_home_dir}/config.ini'
     if not Path(config_file).is_file():
@@ -83,6 +99,7 @@ def _read_config():
     return config
 
 def _make_script(filename, script, format_values=None, how_to_install=None, how_to_use=None, show_only=False):
+    from PM3.libs.system_scripts import pm3_scripts
     if format_values:
         script_text = pm3_scripts[script].format(**format_values)
     else:
@@ -105,41 +122,130 @@ def _make_script(filename, script, format_values=None, how_to_install=None, how_
         print('\n[yellow]HOW TO USE:[/yellow]')
         print(how_to_use)
 
-def _get(path) -> RetMsg:
+class _RetMsg:
+    """
+    RetMsg del backend senza pydantic (da solo e' piu' di meta' del tempo di
+    import della cli): le risposte arrivano dal backend gia' validate
+    """
+    __slots__ = ('msg', 'err', 'warn', 'payload')
+
+    def __init__(self, msg='', err=False, warn=False, payload=None, **_):
+        self.msg = msg
+        self.err = err
+        self.warn = warn
+        self.payload = payload
+
+@lru_cache(maxsize=None)
+def _client():
+    # Socket unix se il backend lo espone, connessioni riusate tra le chiamate,
+    # risposte di ls e ps conservate in ~/.pm3/cache per le richieste condizionali
     config = _read_config()
-    base_url = config['backend'].get('url')
+    cache_dir = None
+    if config['main_section'].getboolean('cli_cache', True):
+        cache_dir = Path(config['main_section'].get('pm3_home_dir', '~/.pm3'), 'cache').expanduser().as_posix()
+    return Client(config['backend'].get('url'), timeout=5, unix_socket=config_socket_path(config),
+                  cache_dir=cache_dir)
+
+def _get(path, cached=False, params=None) -> _RetMsg:
+    # cached: il backend risponde 304 se non e' cambiato nulla (ETag)
     try:
-        r = requests.get(f'{base_url}/{path}', timeout=5)
-    except requests.exceptions.ConnectionError as e:
-        return RetMsg(err=True, msg=str(e))
+        status, ret = _client().get(path, params=params, cached=cached)
+    except BackendError as e:
+        return _RetMsg(err=True, msg=str(e))
 
-    if r.status_code == 200:
-        ret = r.json()
-        return RetMsg(**ret)
+    if status == 200 and ret is not None:
+        return _RetMsg(**ret)
     else:
-        return RetMsg(err=True, msg=f'Connection Error ({r.status_code})')
+        return _RetMsg(err=True, msg=f'Connection Error ({status})')
 
 def _post(path, jdata):
-    config = _read_config()
-    base_url = config['backend'].get('url')
     try:
-        r = requests.post(f'{base_url}/{path}', json=jdata)
-    except requests.exceptions.ConnectionError:
-        return RetMsg(err=True, msg=f'Connection Error')
+        status, ret = _client().post(path, jdata)
+    except BackendError:
+        return _RetMsg(err=True, msg=f'Connection Error')
 
-    if r.status_code == 200:
-        ret = r.json()
-        return RetMsg(**ret)
+    if status == 200 and ret is not None:
+        return _RetMsg(**ret)
     else:
-        return RetMsg(err=True, msg=f'Connection Error ({r.status_code})')
+        return _RetMsg(err=True, msg=f'Connection Error ({status})')
 
-def _parse_retmsg(res: RetMsg):
+def _post_bulk(rows, rewrite=False):
+    # Tutti i processi in una richiesta (json lines in streaming) a /new/bulk
+    try:
+        status, ret = _client().post_lines('new/bulk/rewrite' if rewrite else 'new/bulk', rows)
+    except BackendError:
+        return _RetMsg(err=True, msg='Connection Error')
+
+    if status == 200 and ret is not None:
+        return _RetMsg(**ret)
+    else:
+        return _RetMsg(err=True, msg=f'Connection Error ({status})')
+
+def _parse_bulk(res: _RetMsg):
+    # Solo le voci con errori o avvisi, poi il riepilogo
+    if res.err:
+        print(f"[red]{res.msg}[/red]")
+        return
+    for pi in res.payload or []:
+        if pi['err']:
+            print(f"[red]{pi['msg']}[/red]")
+        elif pi['warn']:
+            print(f"[yellow]{pi['msg']}[/yellow]")
+    color = 'yellow' if res.warn else 'green'
+    print(f"[{color}]{res.msg}[/{color}]")
+
+def _follow_logs(id_or_name, stream, lines):
+    # Log in follow dal backend (SSE): righe di tutti i processi, prefissate
+    params = {'follow': 1, 'lines': lines, 'stream': stream}
+    try:
+        with _client().stream(f'logs/{id_or_name}', params=params, headers={'Accept': 'text/event-stream'}) as r:
+            if not r.getheader('Content-Type', '').startswith('text/event-stream'):
+                _parse_retmsg(_RetMsg(**json.loads(r.read())))
+                return
+            for line in r:
+                if line.startswith(b'data: '):
+                    sys.stdout.write(line[6:].decode(errors='replace').rstrip('\r\n') + '\n')
+                    sys.stdout.flush()
+    except (BackendError, OSError) as e:
+        print(f'[red]{e}[/red]')
+
+_TIME_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+def _parse_time(v):
+    # 30m, 2h, 1d, 1w: tempo fa; altrimenti timestamp o data (es. 2024-05-01T10:00)
+    if v[:-1].replace('.', '', 1).isdigit() and v[-1] in _TIME_UNITS:
+        return time.time() - float(v[:-1]) * _TIME_UNITS[v[-1]]
+    try:
+        return float(v)
+    except ValueError:
+        pass
+    try:
+        import pendulum
+        return pendulum.parse(v, tz=pendulum.local_timezone()).timestamp()
+    except Exception:
+        raise argparse.ArgumentTypeError(f'invalid time: {v}')
+
+def _search_logs(id_or_name, stream, pattern, since, until, ignore_case):
+    # Ricerca nei log (anche ruotati) fatta dal backend con l'indice dei file
+    params = {'stream': stream, 'ignore_case': int(ignore_case), 'grep': pattern, 'since': since, 'until': until}
+    try:
+        with _client().stream(f'logs/{id_or_name}', params=params) as r:
+            if not r.getheader('Content-Type', '').startswith('text/plain'):
+                _parse_retmsg(_RetMsg(**json.loads(r.read())))
+                return
+            for line in r:
+                sys.stdout.write(line.decode(errors='replace'))
+            sys.stdout.flush()
+    except (BackendError, OSError) as e:
+        print(f'[red]{e}[/red]')
+
+def _parse_retmsg(res: _RetMsg):
     if res.err:
         print(f"[red]{res.msg}[/red]")
 
     elif res.payload:
         for pi in res.payload:
-            pi = RetMsg(**pi)
+            pi = _RetMsg(**pi)
             if pi.err:
                 print(f"[red]{pi.msg}[/red]")
             elif pi.warn:
@@ -154,8 +260,48 @@ def _parse_retmsg(res: RetMsg):
             print(f"[green]{res.msg}[/green]")
 
 
-def _ls(id_or_name='all', _format='table'):
-    res = _get(f'ls/{id_or_name}')
+def _show_cached(path, format_, show, params=None):
+    """
+    Stampa show(res) per la risposta di path. Se il backend risponde 304
+    (niente di cambiato) e la stessa vista (formato e terminale) e' in
+    cache la stampa cosi' com'e', senza json e senza rifare la tabella.
+    """
+    client = _client()
+    view = (f'view:{path}:{params}:{format_}:{shutil.get_terminal_size().columns}:{sys.stdout.isatty()}'
+            f":{os.environ.get('TERM')}:{os.environ.get('NO_COLOR')}")
+    etag = None
+    try:
+        status, data, etag, not_modified = client.get_conditional(path, params)
+    except BackendError as e:
+        res = _RetMsg(err=True, msg=str(e))
+    else:
+        if not_modified:
+            cached = client.cache_load(view)
+            if cached and cached[0] == etag:
+                sys.stdout.buffer.write(cached[1])
+                sys.stdout.flush()
+                return
+        try:
+            ret = json.loads(data)
+        except ValueError:
+            ret = None
+        if status == 200 and ret is not None:
+            res = _RetMsg(**ret)
+        else:
+            res = _RetMsg(err=True, msg=f'Connection Error ({status})')
+
+    from rich.console import Console
+    console = Console()
+    with console.capture() as capture:
+        console.print(show(res))
+    out = capture.get()
+    sys.stdout.write(out)
+    if etag and not res.err:
+        client.cache_store(view, etag, out.encode())
+
+def _ls(id_or_name='all', _format='table', res=None):
+    if res is None:
+        res = _get(f'ls/{id_or_name}', cached=True)
     if res.err:
         _parse_retmsg(res)
         return ''
@@ -165,14 +311,23 @@ def _ls(id_or_name='all', _format='table'):
         if _format == 'table':
             return _tabulate_ls(payload_sorted)
         elif _format == 'json':
-            return json.dumps([ProcessList(**i).dict() for i in payload_sorted], indent=2)
+            from PM3.model.process import list_row
+            return json.dumps([list_row(i) for i in payload_sorted], indent=2)
         else:
             return _show_list(payload_sorted)
     else:
         return '[yellow]there is nothing to look at[/yellow]'
 
-def _ps(id_or_name='all', _format='table'):
-    res = _get(f'ps/{id_or_name}')
+def _ps_params(_format):
+    # La tabella chiede al backend solo le sue colonne
+    if _format == 'table':
+        from PM3.model.process import STATUS_LIGHT_FIELDS
+        return {'fields': ','.join(STATUS_LIGHT_FIELDS)}
+    return None
+
+def _ps(id_or_name='all', _format='table', res=None):
+    if res is None:
+        res = _get(f'ps/{id_or_name}', cached=True, params=_ps_params(_format))
     if res.err:
         _parse_retmsg(res)
         return ''
@@ -182,7 +337,8 @@ def _ps(id_or_name='all', _format='table'):
             payload_sorted = sorted(res.payload, key=lambda item: item.get("pm3_id"))
             if _format == 'table':
                 return _tabulate_ps(payload_sorted)
-            elif _format == 'json':
+            from PM3.model.process import ProcessStatus
+            if _format == 'json':
                 return json.dumps([ProcessStatus(**p).dict() for p in payload_sorted], indent=2)
             else:
                 payload_sorted = [ProcessStatus(**p).dict() for p in payload_sorted]
@@ -192,6 +348,59 @@ def _ps(id_or_name='all', _format='table'):
     else:
         return f'[red]{res.msg}[/red]'
 
+def _sparkline(values):
+    blocks = '▁▂▃▄▅▆▇█'
+    if not values:
+        return ''
+    lo, hi = min(values), max(values)
+    span = (hi - lo) or 1
+    return ''.join(blocks[int((v - lo) / span * (len(blocks) - 1))] for v in values)
+
+def _human(v, field):
+    if field in ('rss', 'read_bytes', 'write_bytes'):
+        for unit in ('B', 'K', 'M', 'G'):
+            if abs(v) < 1024:
+                return f'{v:.1f}{unit}'
+            v /= 1024
+        return f'{v:.1f}T'
+    elif field == 'cpu_percent':
+        return f'{v:.1f}%'
+    return f'{v:.0f}'
+
+def _history(id_or_name='all', since=3600, width=40):
+    step = max(since / width, 1)
+    res = _get(f'metrics/history/{id_or_name}?since=-{since}&step={step}')
+    if res.err:
+        _parse_retmsg(res)
+        return ''
+    if not res.payload:
+        return '[yellow]there is nothing to look at[/yellow]'
+
+    from rich.table import Table
+    table = Table(show_header=True, header_style="bold green")
+    for h in ('pm3_id', 'pm3_name', 'metric', 'last', 'min', 'max'):
+        table.add_column(h)
+    table.add_column(f'last {since}s', no_wrap=True, min_width=width)
+
+    for ph in sorted(res.payload, key=lambda item: item.get("pm3_id")):
+        if not ph.get('retained', True):
+            table.add_row(str(ph['pm3_id']), ph['pm3_name'], '[yellow]history not retained[/yellow]',
+                          '', '', '', '[yellow]raise history_max_mb[/yellow]')
+            table.add_section()
+            continue
+        points = ph['points']
+        for n, field in enumerate(ph['fields'][1:], start=1):
+            values = [p[n] for p in points]
+            if values:
+                last, lo, hi = (_human(v, field) for v in (values[-1], min(values), max(values)))
+            else:
+                last = lo = hi = '-'
+            table.add_row(str(ph['pm3_id']) if n == 1 else '',
+                          ph['pm3_name'] if n == 1 else '',
+                          field, last, lo, hi, _sparkline(values))
+        table.add_section()
+    return table
+
 def _show_list(data):
     out = []
     for row in data:
@@ -204,12 +413,15 @@ def _show_list(data):
 def _tabulate_ps(data):
     if len(data) == 0:
         return '[yellow]there is nothing to look at[/yellow]'
+    from rich.console import Console
+    from rich.table import Table
+    from PM3.model.process import status_light_rows
     c = Console()
 
     table = Table(show_header=True, header_style="bold green")
 
-    for n, r in enumerate(data):
-        r = ProcessStatusLight(**r).dict()  # Validate and sort
+    # Il payload del backend e' gia' valido: solo formattazione, niente pydantic
+    for n, r in enumerate(status_light_rows(data)):
         if n == 0:
             for h in r.keys():
                 table.add_column(h)
@@ -223,13 +435,15 @@ def _tabulate_ps(data):
 def _tabulate_ls(data):
     if len(data) == 0:
         return '[yellow]there is nothing to look at[/yellow]'
+    from rich.console import Console
+    from rich.table import Table
+    from PM3.model.process import list_row
     c = Console()
 
     table = Table(show_header=True, header_style="bold yellow")
 
     for n, r in enumerate(data):
-        #r = Process(**r).dict()  # Validate and sort
-        r = ProcessList(**r).dict()  # Validate and sort
+        r = list_row(r)  # Format and sort
         if n == 0:
             for h in r.keys():
                 table.add_column(h)
@@ -246,6 +460,7 @@ def _tabulate_ls(data):
     return table
 
 def _show_status(res, light=True):
+    from PM3.model.process import ProcessStatus, ProcessStatusLight
     for proc in res:
         if light:
             p = ProcessStatusLight(**proc)
@@ -278,6 +493,7 @@ def _dump(args) -> str:
 
 def killtree(pid, killme=True, signal=9):
     """Kill a process tree"""
+    import psutil
     myself = psutil.Process(int(pid))
     children = myself.children(recursive=True)
     if killme:
@@ -318,6 +534,11 @@ def main():
     parser_ps.add_argument('id_or_name', const='all', nargs='?', type=str, help='id or process name')
     parser_ps.add_argument('-l', '--list', action='store_true', help='List format')
     parser_ps.add_argument('-j', '--json', action='store_true', help='Json format')
+    parser_ps.add_argument('--history', action='store_true', help='metrics history (sparklines)')
+    parser_ps.add_argument('--since', type=int, default=3600, help='history window in seconds')
+
+    parser_monit = subparsers.add_parser('monit', help='live dashboard of all processes')
+    parser_monit.add_argument('--interval', type=float, default=1, help='seconds between updates')
 
     parser_new = subparsers.add_parser('new', help='create a new process')
     parser_new.add_argument('cmd', help='linux command')
@@ -331,6 +552,13 @@ def main():
     parser_new.add_argument('--stderr', dest='pm3_stderr', help='std err')
     parser_new.add_argument('--interpreter', dest='interpreter', help='interpreter path')
     parser_new.add_argument('--max-restart', dest='max_restart', type=int, default=1000, help='maximal restart times')
+    parser_new.add_argument('--stop-signal', dest='stop_signal', default='SIGTERM', help='signal sent by stop')
+    parser_new.add_argument('--stop-timeout', dest='stop_timeout', type=float, help='seconds before SIGKILL')
+    parser_new.add_argument('--no-kill', dest='stop_kill', action='store_false', help='never escalate to SIGKILL')
+    parser_new.add_argument('--log-max-mb', dest='log_max_mb', type=float, help='rotate logs above this size (0 never)')
+    parser_new.add_argument('--log-backups', dest='log_backups', type=int, help='rotated log files kept')
+    parser_new.add_argument('--log-compress', dest='log_compress', action=argparse.BooleanOptionalAction,
+                            help='gzip rotated log files')
 
     parser_edit = subparsers.add_parser('edit', help='edit existing process')
     parser_edit.add_argument('id_or_name', help='id or process name')
@@ -358,11 +586,19 @@ def main():
     parser_log.add_argument('id_or_name', const='all', nargs='?', type=str, help='id or process name')
     parser_log.add_argument('-f', '--follow', action='store_true', help='tail follow')
     parser_log.add_argument('-n', '--lines', const=10, default=10, nargs='?', type=int, help='how many lines')
+    parser_log.add_argument('-g', '--grep', metavar='PATTERN', help='search lines matching PATTERN (regex), rotated logs included')
+    parser_log.add_argument('--since', type=_parse_time, help='lines written after (30m, 2h, 1d, timestamp or date)')
+    parser_log.add_argument('--until', type=_parse_time, help='lines written before (30m, 2h, 1d, timestamp or date)')
+    parser_log.add_argument('-i', '--ignore-case', action='store_true', help='case insensitive --grep')
 
     parser_err = subparsers.add_parser('err', help='show log for a process')
     parser_err.add_argument('id_or_name', const='all', nargs='?', type=str, help='id or process name')
     parser_err.add_argument('-f', '--follow', action='store_true', help='tail follow')
     parser_err.add_argument('-n', '--lines', const=10, default=10, nargs='?', type=int, help='how many lines')
+    parser_err.add_argument('-g', '--grep', metavar='PATTERN', help='search lines matching PATTERN (regex), rotated logs included')
+    parser_err.add_argument('--since', type=_parse_time, help='lines written after (30m, 2h, 1d, timestamp or date)')
+    parser_err.add_argument('--until', type=_parse_time, help='lines written before (30m, 2h, 1d, timestamp or date)')
+    parser_err.add_argument('-i', '--ignore-case', action='store_true', help='case insensitive --grep')
 
     parser_flush = subparsers.add_parser('flush', help='Flush logs')
     parser_flush.add_argument('id_or_name', help='id or process name')
@@ -377,7 +613,10 @@ def main():
     parser_load.add_argument('-r', '--rewrite', dest='load_rewrite', action='store_true', help='rewrite if process already exist')
     parser_load.add_argument('-y', '--yes', dest='load_yes', action='store_true', help='response always yes')
 
-    argcomplete.autocomplete(parser)
+    if '_ARGCOMPLETE' in os.environ:
+        # Solo durante il completamento della shell
+        import argcomplete
+        argcomplete.autocomplete(parser)
     args = parser.parse_args()
     kwargs = vars(args)
     logging.debug(kwargs)
@@ -402,6 +641,8 @@ def main():
             if not res.err:
                 print(f"process running on pid {msg['pid']}")
             else:
+                import psutil
+                from PM3.model.process import Process
                 backend = Process(cmd=config['backend'].get('cmd'),
                                   interpreter=config['main_section'].get('main_interpreter'),
                                   pm3_name=backend_process_name,
@@ -463,14 +704,24 @@ def main():
     elif args.subparser == 'ls':
         id_or_name = args.id_or_name or 'all'
         format_ = 'list' if args.list else 'json' if args.json else 'table'
-        print(_ls(id_or_name, format_))
+        _show_cached(f'ls/{id_or_name}', format_, lambda res: _ls(id_or_name, format_, res))
 
     elif args.subparser == 'ps':
         id_or_name = args.id_or_name or 'all'
         format_ = 'list' if args.list else 'json' if args.json else 'table'
-        print(_ps(id_or_name, format_))
+        if args.history:
+            from rich.console import Console
+            width = max(10, Console().width - 75)
+            print(_history(id_or_name, args.since, width))
+        else:
+            _show_cached(f'ps/{id_or_name}', format_, lambda res: _ps(id_or_name, format_, res),
+                         params=_ps_params(format_))
+    elif args.subparser == 'monit':
+        from PM3.libs.monitview import monit
+        monit(_client(), args.interval)
     elif args.subparser == 'edit':
         import subprocess
+        from PM3.model.process import Process
         from shutil import which
         editors = ("nano", "pico", "vim", "vi", "emacs")
         editor_path = str()
@@ -495,13 +746,8 @@ def main():
                     print(f' -> [red]{e}[/red]')
                     sys.exit(1)
 
-                for pr in prl:
-                    p = Process(**pr)
-
-                    post_dest = 'new/rewrite'
-                    res = _post(post_dest, p.dict())
-                    _parse_retmsg(res)
-                    logger.debug('done')
+                _parse_bulk(_post_bulk([Process(**pr).dict() for pr in prl], rewrite=True))
+                logger.debug('done')
 
             finally:
                 os.remove(tmpFile.name)
@@ -509,6 +755,7 @@ def main():
             print("[yellow]nothing to dump![/yellow]")
 
     elif args.subparser == 'new':
+        from PM3.model.process import Process
         p = Process(cmd=args.cmd,
                     cwd=args.cwd or Path.home().as_posix(),
                     pm3_name=args.pm3_name or '',
@@ -519,7 +766,13 @@ def main():
                     autorun=args.pm3_autorun,
                     stdout=args.pm3_stdout or '',
                     stderr=args.pm3_stderr or '',
-                    max_restart=args.max_restart)
+                    max_restart=args.max_restart,
+                    stop_signal=args.stop_signal,
+                    stop_timeout=args.stop_timeout,
+                    stop_kill=args.stop_kill,
+                    log_max_mb=args.log_max_mb,
+                    log_backups=args.log_backups,
+                    log_compress=args.log_compress)
         res = _post('new', p.dict())
         if res.err:
             print(res)
@@ -549,29 +802,34 @@ def main():
         _parse_retmsg(res)
 
     elif args.subparser in ('log', 'err'):
-        res = _get(f"ls/{args.id_or_name or 'all'}")
-        if res and not res.err:
-            for p in res.payload:
-                ftt = p['stdout'] if args.subparser == 'log' else p['stderr']
-                print()
+        if args.grep is not None or args.since is not None or args.until is not None:
+            try:
+                _search_logs(args.id_or_name or 'all', 'out' if args.subparser == 'log' else 'err',
+                             args.grep, args.since, args.until, args.ignore_case)
+            except KeyboardInterrupt:
+                pass
+        elif args.follow:
+            # Il backend unisce e segue i log di tutti i processi
+            try:
+                _follow_logs(args.id_or_name or 'all', 'out' if args.subparser == 'log' else 'err', args.lines)
+            except KeyboardInterrupt:
+                pass
+        else:
+            from PM3.libs.logtail import tail
+            res = _get(f"ls/{args.id_or_name or 'all'}")
+            if res and not res.err:
+                for p in res.payload:
+                    ftt = p['stdout'] if args.subparser == 'log' else p['stderr']
+                    print()
 
-                if not Path(ftt).is_file():
-                    print(f"[yellow] !!! file {ftt} don't exist !!! [/yellow]")
-                    continue
+                    if not Path(ftt).is_file():
+                        print(f"[yellow] !!! file {ftt} don't exist !!! [/yellow]")
+                        continue
 
-                print(f"[yellow2] #### {ftt} #### [/yellow2]")
+                    print(f"[yellow2] #### {ftt} #### [/yellow2]")
 
-                try:
-                    if args.follow:
-                        asyncio.run(tailfile(ftt, lines=args.lines))
-                    else:
-                        with open(ftt, "r") as f1:
-                            last_line = f1.readlines()[-args.lines:]
-                            for r in last_line:
-                                print(r, end='')
-                except KeyboardInterrupt:
-                    #print('CTRL+C')
-                    pass
+                    for r in tail(ftt, args.lines):
+                        print(r, end='')
 
     elif args.subparser == 'flush':
         res = _get(f"ls/{args.id_or_name}")
@@ -593,6 +851,9 @@ def main():
                             continue
                         else:
                             open(Path(ftt), 'w').close()
+                            if Path(f'{ftt}.idx').is_file():
+                                # L'indice del file svuotato non e' piu' valido
+                                open(Path(f'{ftt}.idx'), 'w').close()
                             print(f"[yellow2] {ftt} is emptied [/yellow2]")
 
 
@@ -600,6 +861,7 @@ def main():
         _dump(args)
 
     elif args.subparser == 'load':
+        from PM3.model.process import Process
         load_file = Path(args.load_file).as_posix()
         if not load_file.endswith('.json'):
             print('[red]File to load must be a json file[/red]')
@@ -612,21 +874,23 @@ def main():
                 print(f'[red]ERROR:[/red] {load_file} is not a valid json file')
                 print(f' -> [red]{e}[/red]')
                 sys.exit(1)
-        for pr in prl:
-            p = Process(**pr)
-            if args.load_yes:
-                r = 'y'
-            else:
+        if args.load_yes:
+            # Validazione nel backend, voce per voce
+            _parse_bulk(_post_bulk(prl, rewrite=args.load_rewrite))
+        else:
+            to_load = []
+            for pr in prl:
+                p = Process(**pr)
                 r = input(f'do you want load {p.pm3_name} ({p.pm3_id}) ?')
 
-            if r == 'y':
-                post_dest = 'new' if args.load_rewrite is False else 'new/rewrite'
-                res = _post(post_dest, p.dict())
-                _parse_retmsg(res)
-            elif r == 'n':
-                print(f'[yellow]skip import {p.pm3_name} ({p.pm3_id})[/yellow]')
-            else:
-                print(f'[red]only y or n are accepted... skip[/red]')
+                if r == 'y':
+                    to_load.append(p.dict())
+                elif r == 'n':
+                    print(f'[yellow]skip import {p.pm3_name} ({p.pm3_id})[/yellow]')
+                else:
+                    print(f'[red]only y or n are accepted... skip[/red]')
+            if to_load:
+                _parse_bulk(_post_bulk(to_load, rewrite=args.load_rewrite))
 
     else:
         print(parser.format_help())
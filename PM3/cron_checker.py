@@ -1,7 +1,7 @@
 import time
 
-import requests
 from PM3.model.pm3_protocol import RetMsg
+from PM3.libs.client import Client, BackendError, config_socket_path
 from PM3.model.process import Process
 from rich import print
 from pathlib import Path
@@ -17,16 +17,17 @@ config = ConfigParser()
 config.read(config_file)
 base_url = config['backend'].get('url')
 sleep_time = int(config['cron_checker'].get('sleep_time'))
+# Una connessione keep-alive (socket unix se disponibile) per tutti i controlli
+client = Client(base_url, timeout=None, unix_socket=config_socket_path(config))
 
 def _get(path) -> RetMsg:
     #TODO: duplicato presente in cli.py
     try:
-        r = requests.get(f'{base_url}/{path}')
-    except requests.exceptions.ConnectionError as e:
+        status, ret = client.get(path)
+    except BackendError as e:
         return RetMsg(err=True, msg=str(e))
 
-    if r.status_code == 200:
-        ret = r.json()
+    if status == 200 and ret is not None:
         return RetMsg(**ret)
     else:
         return RetMsg(err=True, msg='Connection Error')
@@ -52,10 +53,25 @@ def check_autostart():
     else:
         print(res)
 
+def wait_exit(since=None):
+    # Aspetta l'uscita di un processo (long-poll su /events) al massimo
+    # sleep_time secondi: un processo uscito viene riavviato subito.
+    # Restituisce il seq da cui ripartire
+    try:
+        status, ret = client.get('events', params={'since': since, 'wait': sleep_time, 'types': 'exited'})
+    except BackendError:
+        status, ret = None, None
+    if status != 200 or ret is None or ret.get('err'):
+        # Backend irraggiungibile o senza /events
+        time.sleep(sleep_time)
+        return since
+    return ret['payload']['last']
+
 def main():
+    since = None
     while True:
         check_autostart()
-        time.sleep(sleep_time)
+        since = wait_exit(since)
 
 if __name__ == '__main__':
     main()
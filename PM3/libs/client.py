@@ -0,0 +1,262 @@
+import os
+import json
+import socket
+import selectors
+import hashlib
+import threading
+import http.client
+from urllib.parse import urlsplit, urlencode
+
+
+def config_socket_path(config):
+    """Socket unix del backend da config.ini ([backend] socket, vuoto: nessuno)"""
+    path = config['backend'].get('socket', '~/.pm3/pm3.sock')
+    return os.path.expanduser(path) if path else None
+
+
+class BackendError(Exception):
+    """Backend non raggiungibile o risposta non valida"""
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection su un socket unix"""
+    def __init__(self, path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.unix_path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+class Client:
+    """
+    Client http del backend basato su http.client: importare requests
+    costa piu' di tutto il resto della cli.
+    Usa il socket unix del backend se esiste, altrimenti l'url tcp, e tiene
+    aperte (keep-alive) fino a pool_size connessioni tra una chiamata e
+    l'altra: load, edit e il cron checker non riaprono una connessione
+    per ogni richiesta.
+    cache_dir: cartella delle risposte conservate con il loro ETag
+    (get con cached=True), al massimo cache_size file.
+    """
+    def __init__(self, url, timeout=5, unix_socket=None, pool_size=4, cache_dir=None, cache_size=32):
+        u = urlsplit(url)
+        self.host = u.hostname or '127.0.0.1'
+        self.port = u.port or 80
+        self.prefix = u.path.rstrip('/')
+        self.timeout = timeout
+        self.unix_socket = unix_socket if unix_socket and os.path.exists(unix_socket) else None
+        self.pool_size = pool_size
+        self.cache_dir = cache_dir
+        self.cache_size = cache_size
+        self._idle = []
+        self._lock = threading.Lock()
+
+    @property
+    def transport(self):
+        return 'unix' if self.unix_socket else 'tcp'
+
+    def _url(self, path, params=None):
+        url = f"{self.prefix}/{path.lstrip('/')}"
+        if params:
+            url += '?' + urlencode({k: v for k, v in params.items() if v is not None})
+        return url
+
+    def _connect(self):
+        if self.unix_socket:
+            conn = UnixHTTPConnection(self.unix_socket, timeout=self.timeout)
+            try:
+                conn.connect()
+                return conn
+            except OSError:
+                # Socket rimasto da un backend terminato o backend senza socket
+                self.unix_socket = None
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    @staticmethod
+    def _closed_by_peer(conn):
+        # Una connessione inattiva leggibile e' stata chiusa dal backend
+        # (server_timeout): EOF senza che sia stata inviata una richiesta
+        if conn.sock is None:
+            return True
+        with selectors.DefaultSelector() as sel:
+            sel.register(conn.sock, selectors.EVENT_READ)
+            return bool(sel.select(0))
+
+    def _acquire(self):
+        # (connessione, riusata)
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn = self._idle.pop()
+            if not self._closed_by_peer(conn):
+                return conn, True
+            conn.close()
+        return self._connect(), False
+
+    def _release(self, conn, r):
+        # Da chiamare con la risposta letta tutta
+        if r.will_close or conn.sock is None:
+            conn.close()
+            return
+        conn.sock.settimeout(self.timeout)
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def _request(self, method, path, params=None, body=None, headers=None, read_timeout=False):
+        headers = dict(headers or {})
+        chunked = hasattr(body, '__next__')
+        if body is not None and not chunked and not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+            headers.setdefault('Content-Type', 'application/json')
+        url = self._url(path, params)
+        while True:
+            conn, reused = self._acquire()
+            try:
+                conn.request(method, url, body=body, headers=headers, encode_chunked=chunked)
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                if reused and not chunked:
+                    # Connessione keep-alive chiusa dal backend prima dell'invio: ne apro una nuova
+                    continue
+                raise BackendError(str(e)) from e
+            try:
+                sock = conn.sock
+                r = conn.getresponse()
+            except (OSError, http.client.HTTPException) as e:
+                # Richiesta gia' inviata: il backend puo' averla eseguita
+                # (/start, /stop, /new...), non la ripeto
+                conn.close()
+                raise BackendError(str(e)) from e
+            if read_timeout is not False:
+                sock.settimeout(read_timeout)
+            return conn, r
+
+    def request(self, method, path, params=None, body=None, headers=None, read_timeout=False):
+        """
+        Invia la richiesta e restituisce la risposta (http.client.HTTPResponse)
+        da leggere, anche a pezzi. read_timeout: timeout delle letture dopo
+        gli header della risposta (None nessun limite), di default self.timeout.
+        La connessione non torna nel pool.
+        """
+        return self._request(method, path, params, body, headers, read_timeout)[1]
+
+    def stream(self, path, params=None, headers=None):
+        # Risposta letta per righe senza timeout (log in follow)
+        return self.request('GET', path, params=params, headers=headers, read_timeout=None)
+
+    def _fetch(self, method, path, params=None, body=None, headers=None, read_timeout=False):
+        # (risposta, corpo) con la connessione gia' tornata nel pool
+        conn, r = self._request(method, path, params=params, body=body, headers=headers, read_timeout=read_timeout)
+        try:
+            data = r.read()
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            raise BackendError(str(e)) from e
+        self._release(conn, r)
+        return r, data
+
+    def json(self, method, path, params=None, body=None, headers=None, read_timeout=False):
+        """(status, json della risposta o None)"""
+        r, data = self._fetch(method, path, params=params, body=body, headers=headers, read_timeout=read_timeout)
+        try:
+            return r.status, json.loads(data)
+        except ValueError:
+            return r.status, None
+
+    def get(self, path, params=None, cached=False):
+        """
+        (status, json). cached=True: la risposta viene conservata con il suo
+        ETag e riusata quando il backend risponde 304 (non modificata)
+        """
+        if not cached or not self.cache_dir:
+            return self.json('GET', path, params=params)
+        status, data, _, _ = self.get_conditional(path, params)
+        try:
+            return status, json.loads(data)
+        except ValueError:
+            return status, None
+
+    def get_conditional(self, path, params=None):
+        """
+        GET con If-None-Match dalla cache: (status, corpo, etag, not_modified).
+        Con not_modified=True il corpo e' quello in cache e status e' 200
+        """
+        key = f'{self.host}:{self.port}{self._url(path, params)}'
+        entry = self.cache_load(key)
+        headers = {'If-None-Match': entry[0]} if entry else None
+        r, data = self._fetch('GET', path, params=params, headers=headers)
+        etag = r.getheader('ETag')
+        if r.status == 304 and entry:
+            return 200, entry[1], entry[0], True
+        if r.status == 200 and etag:
+            self.cache_store(key, etag, data)
+        return r.status, data, etag, False
+
+    def _cache_file(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest()[:24])
+
+    def cache_load(self, key):
+        """(etag, dati) conservati per key o None"""
+        if not self.cache_dir:
+            return None
+        cache_file = self._cache_file(key)
+        # Il file e' la riga dell'ETag seguita dai dati
+        try:
+            with open(cache_file, 'rb') as f:
+                etag = f.readline().rstrip(b'\n').decode()
+                data = f.read()
+        except OSError:
+            return None
+        # Usato di recente: ultimo a essere scartato
+        try:
+            os.utime(cache_file)
+        except OSError:
+            pass
+        return (etag, data) if etag else None
+
+    def cache_store(self, key, etag, data):
+        # Errori della cache ignorati: al peggio la prossima richiesta e' completa
+        if not self.cache_dir:
+            return
+        try:
+            os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+            cache_file = self._cache_file(key)
+            tmp = f'{cache_file}.{os.getpid()}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(etag.encode() + b'\n' + data)
+            os.replace(tmp, cache_file)
+            files = [os.path.join(self.cache_dir, i) for i in os.listdir(self.cache_dir)]
+            if len(files) > self.cache_size:
+                files.sort(key=os.path.getmtime)
+                for old in files[:len(files) - self.cache_size]:
+                    os.remove(old)
+        except OSError:
+            pass
+
+    def post(self, path, body, read_timeout=None):
+        # Di default senza limite: new/load possono durare a lungo
+        return self.json('POST', path, body=body, read_timeout=read_timeout)
+
+    def post_lines(self, path, rows, read_timeout=None):
+        """POST in streaming (chunked) di rows come json lines"""
+        body = (json.dumps(row).encode() + b'\n' for row in rows)
+        return self.json('POST', path, body=body, headers={'Content-Type': 'application/x-ndjson'},
+                         read_timeout=read_timeout)
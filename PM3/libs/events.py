@@ -0,0 +1,67 @@
+import itertools
+import threading
+import time
+from collections import deque
+
+# Tipi di evento emessi dal backend
+EVENT_TYPES = ('added', 'edited', 'started', 'restarted', 'exited', 'stopped', 'removed')
+
+
+class EventLog:
+    """
+    Registro in memoria delle transizioni di stato dei processi, numerate
+    (seq) in ordine crescente, con al massimo size eventi.
+    I seq partono dal tempo in microsecondi: un client che arriva da un
+    backend precedente ha un seq che non torna e viene avvisato (missed).
+    wait() blocca senza consumare cpu finche' non arriva un evento.
+    """
+    def __init__(self, size=10000):
+        self.cond = threading.Condition()
+        self.events = deque(maxlen=size)
+        self.seq = int(time.time() * 1000000)
+        self.stats = dict(emitted=0, dropped=0)
+
+    def emit(self, type_, pm3_id, pm3_name, **data):
+        with self.cond:
+            self.seq += 1
+            if len(self.events) == self.events.maxlen:
+                self.stats['dropped'] += 1
+            self.events.append({'seq': self.seq, 'ts': round(time.time(), 3), 'type': type_,
+                                'pm3_id': pm3_id, 'pm3_name': pm3_name, **data})
+            self.stats['emitted'] += 1
+            self.cond.notify_all()
+
+    def _since(self, seq, types=None, limit=None):
+        # Da chiamare con self.cond
+        first = self.events[0]['seq'] if self.events else self.seq + 1
+        # Eventi persi: gia' usciti dal buffer, o seq di un altro backend
+        missed = seq < first - 1 or seq > self.seq
+        start = 0 if missed else seq - first + 1
+        out = [e for e in itertools.islice(self.events, start, None)
+               if types is None or e['type'] in types]
+        if limit and len(out) > limit:
+            out = out[:limit]
+            return out, missed, out[-1]['seq']
+        return out, missed, self.seq
+
+    def since(self, seq, types=None, limit=None):
+        """
+        (eventi con seq > seq, missed, last). missed=True: alcuni eventi
+        non sono piu' disponibili, chi legge deve riallinearsi (es. con /ls).
+        last: seq da usare per la richiesta successiva.
+        """
+        with self.cond:
+            return self._since(seq, types, limit)
+
+    def wait(self, seq, timeout, types=None, limit=None):
+        # Come since() ma aspetta fino a timeout secondi il primo evento
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while True:
+                events, missed, last = self._since(seq, types, limit)
+                remaining = deadline - time.monotonic()
+                if events or missed or remaining <= 0:
+                    return events, missed, last
+                # Solo eventi di tipi non richiesti: riparto dall'ultimo
+                seq = last
+                self.cond.wait(remaining)
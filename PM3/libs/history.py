@@ -0,0 +1,199 @@
+import threading
+import time
+from array import array
+
+# Metriche salvate per ogni processo (somma su processo e figli)
+FIELDS = ('cpu_percent', 'rss', 'num_threads', 'num_fds', 'read_bytes', 'write_bytes')
+
+# Byte occupati da un punto: timestamp (double) + un float per metrica
+POINT_SIZE = array('d').itemsize + array('f').itemsize * len(FIELDS)
+
+
+def tree_metrics(rows):
+    # Aggrega le righe del sampler (processo + figli) in un solo punto
+    out = [0.0] * len(FIELDS)
+    for row in rows:
+        io = row.get('io_counters')
+        mem = row.get('memory_info')
+        out[0] += row.get('cpu_percent') or 0
+        out[1] += mem[0] if mem else 0
+        out[2] += row.get('num_threads') or 0
+        out[3] += row.get('num_fds') or 0
+        out[4] += io[2] if io else 0
+        out[5] += io[3] if io else 0
+    return out
+
+
+class Ring:
+    """Buffer circolare a dimensione fissa basato su array."""
+    def __init__(self, size):
+        self.size = size
+        self.ts = array('d', [0.0]) * size
+        self.values = [array('f', [0.0]) * size for _ in FIELDS]
+        self.head = 0       # prossima posizione da scrivere
+        self.count = 0
+
+    def append(self, ts, values):
+        self.ts[self.head] = ts
+        for col, v in zip(self.values, values):
+            col[self.head] = v
+        self.head = (self.head + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def oldest(self):
+        if self.count == 0:
+            return None
+        return self.ts[(self.head - self.count) % self.size]
+
+    def points(self, since=0, until=None):
+        out = []
+        for n in range(self.count):
+            i = (self.head - self.count + n) % self.size
+            ts = self.ts[i]
+            if ts < since or (until is not None and ts >= until):
+                continue
+            out.append([ts] + [col[i] for col in self.values])
+        return out
+
+
+class ProcessHistory:
+    """
+    Storico di un processo su due livelli: i punti alla risoluzione
+    del campionamento (fine) e, per i dati piu' vecchi, le medie di
+    downsample punti consecutivi (coarse).
+    """
+    def __init__(self, size, coarse_size, downsample):
+        self.fine = Ring(size)
+        self.coarse = Ring(coarse_size)
+        self.downsample = downsample
+        self._acc = [0.0] * len(FIELDS)
+        self._acc_ts = 0.0
+        self._acc_n = 0
+        self.updated = 0.0
+
+    def append(self, ts, values):
+        self.fine.append(ts, values)
+        self.updated = ts
+        self._acc = [a + v for a, v in zip(self._acc, values)]
+        self._acc_ts += ts
+        self._acc_n += 1
+        if self._acc_n >= self.downsample:
+            n = self._acc_n
+            self.coarse.append(self._acc_ts / n, [a / n for a in self._acc])
+            self._acc = [0.0] * len(FIELDS)
+            self._acc_ts = 0.0
+            self._acc_n = 0
+
+    def points(self, since=0):
+        # I punti coarse servono solo prima del piu' vecchio punto fine
+        fine_start = self.fine.oldest()
+        return self.coarse.points(since, until=fine_start) + self.fine.points(since)
+
+    @property
+    def nbytes(self):
+        return (self.fine.size + self.coarse.size) * POINT_SIZE
+
+
+def resample(points, step):
+    # Media dei punti per intervalli di step secondi
+    if not step or not points:
+        return points
+    out = []
+    bucket = None
+    acc = []
+    for p in points:
+        b = int(p[0] // step)
+        if b != bucket and acc:
+            out.append([bucket * step] + [sum(c) / len(acc) for c in zip(*acc)][1:])
+            acc = []
+        bucket = b
+        acc.append(p)
+    if acc:
+        out.append([bucket * step] + [sum(c) / len(acc) for c in zip(*acc)][1:])
+    return out
+
+
+class MetricsHistory:
+    """
+    Storico delle metriche di tutti i processi, alimentato dal sampler.
+    resolution: secondi minimi tra due punti
+    size: punti alla piena risoluzione per processo
+    downsample: punti fine mediati in un punto coarse
+    coarse_size: punti coarse per processo
+    max_bytes: tetto di memoria; oltre il limite i processi senza
+    campioni recenti vengono scartati e i nuovi non vengono registrati
+    (refused, dropped conta i campioni persi). Con max_bytes=0 il tetto
+    e' quanto serve a fleet() processi (fleet: numero di processi gestiti)
+    """
+    def __init__(self, resolution=2, size=1800, downsample=30, coarse_size=1440, max_bytes=0, fleet=None):
+        self.resolution = resolution
+        self.size = size
+        self.downsample = downsample
+        self.coarse_size = coarse_size
+        self.max_bytes = max_bytes
+        self.fleet = fleet
+        self.lock = threading.Lock()
+        self.procs = {}         # pm3_id -> ProcessHistory
+        self.refused = set()    # pm3_id senza storico per mancanza di spazio
+        self.dropped = 0
+
+    @property
+    def nbytes(self):
+        return sum(h.nbytes for h in self.procs.values())
+
+    @property
+    def per_proc(self):
+        return (self.size + self.coarse_size) * POINT_SIZE
+
+    def limit(self, fleet=None):
+        # Tetto in byte: max_bytes o, se 0, lo spazio per fleet processi
+        # (nessun tetto se non si sa quanti sono)
+        if self.max_bytes:
+            return self.max_bytes
+        return self.per_proc * fleet if fleet is not None else float('inf')
+
+    def _new(self, pm3_id, ts, limit):
+        per_proc = self.per_proc
+        if self.nbytes + per_proc > limit:
+            # Libero lo spazio dei processi che non vengono piu' campionati
+            stale = [i for i, h in self.procs.items() if ts - h.updated > self.resolution * self.downsample]
+            for i in sorted(stale, key=lambda i: self.procs[i].updated):
+                del self.procs[i]
+                if self.nbytes + per_proc <= limit:
+                    break
+            else:
+                if self.nbytes + per_proc > limit:
+                    self.dropped += 1
+                    self.refused.add(pm3_id)
+                    return None
+        self.refused.discard(pm3_id)
+        h = self.procs[pm3_id] = ProcessHistory(self.size, self.coarse_size, self.downsample)
+        return h
+
+    def record(self, snapshot, ts=None):
+        ts = ts or time.time()
+        # Fuori dal lock: fleet() legge il registro
+        fleet = self.fleet() if self.fleet and not self.max_bytes else None
+        with self.lock:
+            limit = self.limit(fleet)
+            for pm3_id, rows in snapshot.items():
+                h = self.procs.get(pm3_id) or self._new(pm3_id, ts, limit)
+                if h is None:
+                    continue
+                if h.updated and ts - h.updated < self.resolution:
+                    continue
+                h.append(ts, tree_metrics(rows))
+
+    def forget(self, pm3_id):
+        with self.lock:
+            self.procs.pop(pm3_id, None)
+            self.refused.discard(pm3_id)
+
+    def query(self, pm3_id, since=0, step=0):
+        """Punti di pm3_id, None se lo storico non e' tenuto per mancanza di spazio"""
+        with self.lock:
+            if pm3_id in self.refused:
+                return None
+            h = self.procs.get(pm3_id)
+            points = h.points(since) if h else []
+        return resample(points, step)
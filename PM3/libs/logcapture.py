@@ -0,0 +1,372 @@
+import os
+import re
+import gzip
+import time
+import queue
+import shutil
+import threading
+import selectors
+import logging
+from PM3.libs import logindex
+from PM3.libs.logtail import rotated_files
+
+# file.log.3, file.log.3.gz -> 3
+_SEGMENT_RE = re.compile(r'\.(\d+)(\.gz)?$')
+
+
+class LogFile:
+    """Buffer in memoria di un file di log, condiviso dalle pipe che ci scrivono."""
+    def __init__(self, path, max_bytes, backup_count, compress):
+        self.path = path
+        self.buffer = bytearray()
+        self.streams = 0        # pipe aperte verso questo file
+        self.indexed_at = 0     # timestamp dell'ultima voce dell'indice
+        self.line_start = None  # l'ultimo byte scritto e' un newline
+        # /dev/null, fifo, ...: niente rotazione e niente indice accanto
+        self.regular = os.path.isfile(path)
+        # Policy di rotazione (quella dell'ultimo processo avviato sul file)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.compress = compress
+
+
+def _remove_segment(segment):
+    # Un file ruotato, in chiaro e/o compresso, con il suo indice
+    base = segment[:-3] if segment.endswith('.gz') else segment
+    for p in (base, f'{base}.gz', logindex.index_path(base)):
+        try:
+            os.remove(p)
+        except FileNotFoundError:
+            pass
+
+
+class LogCompressor(threading.Thread):
+    """
+    Compressione dei file ruotati (file.log.1 -> file.log.1.gz, l'indice
+    file.log.1.idx resta valido) e limite di spazio su tutta la directory
+    dei log, fuori dal thread di cattura.
+    La rotazione rinomina i file mentre vengono compressi: il file da
+    comprimere e' identificato dall'inode e rinominato con il lock di
+    LogCapture, preso solo per le rename.
+    Oltre max_total_bytes vengono cancellati i file ruotati piu' vecchi
+    (per data di modifica); i file correnti non vengono mai toccati.
+    """
+    def __init__(self, capture, level=6, max_total_bytes=0, log_dir=None):
+        super().__init__(name='pm3_logcompressor', daemon=True)
+        self.capture = capture
+        self.level = level
+        self.max_total_bytes = max_total_bytes
+        self.log_dir = log_dir
+        self.queue = queue.Queue()
+
+    def submit(self, path, segment=None):
+        # segment None: solo controllo dello spazio
+        if segment is not None:
+            try:
+                segment = os.stat(segment).st_ino
+            except FileNotFoundError:
+                segment = None
+        self.queue.put((path, segment))
+
+    def _locate(self, path, ino):
+        # Nome attuale del file ruotato (in chiaro) con questo inode
+        for segment in rotated_files(path):
+            if segment.endswith('.gz'):
+                continue
+            try:
+                if os.stat(segment).st_ino == ino:
+                    return segment
+            except FileNotFoundError:
+                pass
+        return None
+
+    def _compress(self, path, ino):
+        with self.capture.lock:
+            src = self._locate(path, ino)
+            if src is None:
+                return
+            fin = open(src, 'rb')
+        tmp = f'{src}.gz.tmp'
+        try:
+            with fin, gzip.open(tmp, 'wb', compresslevel=self.level) as fout:
+                shutil.copyfileobj(fin, fout, 1024 * 1024)
+                st = os.fstat(fin.fileno())
+            # La data di modifica e' quella dei dati, non della compressione
+            os.utime(tmp, (st.st_atime, st.st_mtime))
+            with self.capture.lock:
+                src = self._locate(path, ino)
+                if src is None:
+                    # Cancellato dalla rotazione nel frattempo
+                    os.remove(tmp)
+                    return
+                os.replace(tmp, f'{src}.gz')
+                os.remove(src)
+            self.capture.stats['compressed'] += 1
+        except OSError as e:
+            self.capture.stats['errors'] += 1
+            logging.error(f'log compression error on {path}: {e}')
+            try:
+                os.remove(tmp)
+            except FileNotFoundError:
+                pass
+
+    def _enforce_budget(self):
+        if not self.max_total_bytes or not self.log_dir:
+            return
+        total = 0
+        candidates = []
+        try:
+            with os.scandir(self.log_dir) as it:
+                for entry in it:
+                    try:
+                        st = entry.stat(follow_symlinks=False)
+                    except FileNotFoundError:
+                        continue
+                    total += st.st_size
+                    if _SEGMENT_RE.search(entry.name):
+                        candidates.append((st.st_mtime, entry.path, st.st_ino))
+        except FileNotFoundError:
+            return
+        candidates.sort()
+        for _, segment, ino in candidates:
+            if total <= self.max_total_bytes:
+                break
+            with self.capture.lock:
+                # La rotazione puo' averlo rinominato: cancello solo lo stesso file
+                try:
+                    if os.stat(segment).st_ino != ino:
+                        continue
+                except FileNotFoundError:
+                    continue
+                base = segment[:-3] if segment.endswith('.gz') else segment
+                for p in (segment, logindex.index_path(base)):
+                    try:
+                        total -= os.path.getsize(p)
+                        os.remove(p)
+                    except FileNotFoundError:
+                        pass
+            self.capture.stats['evicted'] += 1
+
+    def run(self):
+        while True:
+            path, ino = self.queue.get()
+            if ino is not None:
+                self._compress(path, ino)
+            if self.queue.empty():
+                self._enforce_budget()
+
+
+class LogCapture(threading.Thread):
+    """
+    Cattura di stdout/stderr dei processi gestiti.
+    I figli scrivono su una pipe e un solo thread legge tutte le pipe
+    con un selector. I dati vengono accumulati per file e scritti su disco
+    quando il buffer supera batch_size o ogni flush_interval secondi;
+    il file e' aperto in append solo per la durata della scrittura.
+    Oltre max_bytes il file viene ruotato con una rename (file.1, file.2, ...,
+    al massimo backup_count), senza copiare i dati; con compress i file
+    ruotati vengono compressi da LogCompressor (file.1.gz, ...).
+    max_bytes, backup_count e compress sono i default: ogni processo
+    puo' avere la sua policy (vedi pipe). max_bytes 0 non ruota mai.
+    Il capo di lettura della pipe viene chiuso appena il processo (e i suoi
+    figli) chiudono il capo di scrittura.
+    Al massimo ogni index_interval secondi viene aggiunta una voce
+    (timestamp, offset di inizio riga) all'indice del file (file.idx),
+    usato per le ricerche per intervallo di tempo (logindex.search).
+    """
+    def __init__(self, max_bytes=10 * 1024 ** 2, backup_count=5, batch_size=64 * 1024, flush_interval=0.5,
+                 index_interval=1, compress=True, compress_level=6, max_total_bytes=0, log_dir=None):
+        super().__init__(name='pm3_logcapture', daemon=True)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.compress = compress
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.index_interval = index_interval
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        self.files = {}         # path -> LogFile
+        self._pending = []      # (fd, path, policy) da registrare nel selector
+        self.stats = {'bytes': 0, 'writes': 0, 'rotations': 0, 'compressed': 0, 'evicted': 0, 'errors': 0}
+        self.compressor = LogCompressor(self, compress_level, max_total_bytes, log_dir)
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        self.selector.register(self._wake_r, selectors.EVENT_READ, None)
+
+    def pipe(self, path, max_bytes=None, backup_count=None, compress=None):
+        """
+        Crea una pipe verso path e restituisce il capo di scrittura,
+        da passare al figlio e poi chiudere nel backend.
+        Il file viene creato subito: un path non valido solleva l'errore
+        qui e non nel thread di cattura.
+        max_bytes, backup_count, compress: policy di rotazione del file
+        (None: default di LogCapture)
+        """
+        policy = (self.max_bytes if max_bytes is None else max_bytes,
+                  self.backup_count if backup_count is None else backup_count,
+                  self.compress if compress is None else compress)
+        open(path, 'ab').close()
+        r, w = os.pipe()
+        os.set_blocking(r, False)
+        with self.lock:
+            self._pending.append((r, path, policy))
+        os.write(self._wake_w, b'\0')
+        return w
+
+    @property
+    def streams(self):
+        with self.lock:
+            return sum(f.streams for f in self.files.values())
+
+    def _drain_pending(self):
+        try:
+            while os.read(self._wake_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        with self.lock:
+            pending, self._pending = self._pending, []
+            for fd, path, policy in pending:
+                f = self.files.get(path)
+                if f is None:
+                    f = self.files[path] = LogFile(path, *policy)
+                else:
+                    f.max_bytes, f.backup_count, f.compress = policy
+                f.streams += 1
+                self.selector.register(fd, selectors.EVENT_READ, f)
+
+    def _read(self, fd, f):
+        try:
+            data = os.read(fd, 65536)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            logging.error(f'log capture read error on {f.path}: {e}')
+            data = b''
+        with self.lock:
+            if data:
+                f.buffer += data
+                if len(f.buffer) >= self.batch_size:
+                    self._write(f)
+                return
+            # EOF: il processo ha chiuso il suo capo della pipe
+            self.selector.unregister(fd)
+            os.close(fd)
+            self._write(f)
+            f.streams -= 1
+            if f.streams == 0 and not f.buffer:
+                del self.files[f.path]
+
+    def _rotate(self, f):
+        # Ogni file ruotato (in chiaro o compresso) si porta dietro il suo indice.
+        # Dal piu' vecchio: oltre backup_count viene cancellato, gli altri scalano
+        path = f.path
+        for segment in reversed(rotated_files(path)):
+            n = int(_SEGMENT_RE.search(segment).group(1))
+            if n >= f.backup_count:
+                _remove_segment(segment)
+                continue
+            for suffix in ('', '.gz'):
+                if os.path.exists(f'{path}.{n}{suffix}'):
+                    os.replace(f'{path}.{n}{suffix}', f'{path}.{n + 1}{suffix}')
+            if os.path.exists(logindex.index_path(f'{path}.{n}')):
+                os.replace(logindex.index_path(f'{path}.{n}'), logindex.index_path(f'{path}.{n + 1}'))
+        for src, dst in ((path, f'{path}.1'), (logindex.index_path(path), logindex.index_path(f'{path}.1'))):
+            if not os.path.exists(src):
+                continue
+            if f.backup_count > 0:
+                os.replace(src, dst)
+            else:
+                os.remove(src)
+        self.stats['rotations'] += 1
+        self.compressor.submit(path, f'{path}.1' if f.compress and f.backup_count > 0 else None)
+
+    def _index(self, f, offset, data):
+        # Voce dell'indice sulla prima riga che inizia in data
+        now = time.time()
+        if not self.index_interval or now - f.indexed_at < self.index_interval:
+            return
+        if offset > 0:
+            if f.line_start is None:
+                f.line_start = self._ends_with_newline(f.path, offset)
+            if not f.line_start:
+                k = data.find(b'\n')
+                if k < 0 or k == len(data) - 1:
+                    return
+                offset += k + 1
+        logindex.append(f.path, now, offset)
+        f.indexed_at = now
+
+    @staticmethod
+    def _ends_with_newline(path, size):
+        with open(path, 'rb') as fr:
+            fr.seek(size - 1)
+            return fr.read(1) == b'\n'
+
+    def _write(self, f):
+        # Da chiamare con self.lock
+        if not f.buffer:
+            return
+        data = bytes(f.buffer)
+        f.buffer.clear()
+        try:
+            try:
+                size = os.path.getsize(f.path)
+            except FileNotFoundError:
+                size = 0
+            if f.regular and f.max_bytes and size and size + len(data) > f.max_bytes:
+                self._rotate(f)
+                size = 0
+            with open(f.path, 'ab') as fw:
+                fw.write(data)
+            if f.regular:
+                self._index(f, size, data)
+            f.line_start = data.endswith(b'\n')
+        except OSError as e:
+            self.stats['errors'] += 1
+            logging.error(f'log capture write error on {f.path}: {e}')
+            return
+        self.stats['bytes'] += len(data)
+        self.stats['writes'] += 1
+
+    def flush(self):
+        with self.lock:
+            for f in list(self.files.values()):
+                self._write(f)
+                if f.streams == 0:
+                    del self.files[f.path]
+
+    def compress_leftovers(self, files):
+        """
+        Comprime i file ruotati rimasti in chiaro (backend terminato prima
+        della compressione). files: (path, compress) dei log dei processi,
+        compress None: default di LogCapture.
+        """
+        for path, compress in files:
+            if not (self.compress if compress is None else compress):
+                continue
+            for segment in rotated_files(path):
+                if segment.endswith('.gz'):
+                    continue
+                # Compressione interrotta a meta'
+                try:
+                    os.remove(f'{segment}.gz.tmp')
+                except FileNotFoundError:
+                    pass
+                self.compressor.submit(path, segment)
+
+    def run(self):
+        self.compressor.start()
+        # Spazio su disco all'avvio (i file ruotati rimasti in chiaro
+        # vengono passati da compress_leftovers)
+        self.compressor.submit(None)
+        last_flush = time.monotonic()
+        while True:
+            for key, _ in self.selector.select(self.flush_interval):
+                if key.data is None:
+                    self._drain_pending()
+                else:
+                    self._read(key.fd, key.data)
+            if time.monotonic() - last_flush >= self.flush_interval:
+                self.flush()
+                last_flush = time.monotonic()
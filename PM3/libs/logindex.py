@@ -0,0 +1,97 @@
+import os
+import re
+import gzip
+import struct
+import bisect
+from PM3.libs.logtail import rotated_files
+
+# Voce dell'indice: (timestamp di scrittura, offset di inizio riga)
+ENTRY = struct.Struct('<dQ')
+
+
+def index_path(segment):
+    """Indice di un file di log: x.log -> x.log.idx, x.log.2.gz -> x.log.2.idx"""
+    segment = str(segment)
+    if segment.endswith('.gz'):
+        segment = segment[:-3]
+    return f'{segment}.idx'
+
+
+def append(segment, ts, offset):
+    with open(index_path(segment), 'ab') as f:
+        f.write(ENTRY.pack(ts, offset))
+
+
+def read_index(segment):
+    try:
+        with open(index_path(segment), 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return []
+    return [ENTRY.unpack_from(data, i) for i in range(0, len(data) - ENTRY.size + 1, ENTRY.size)]
+
+
+def byte_range(entries, since=None, until=None):
+    """
+    Byte da leggere per le righe scritte tra since e until: (start, end),
+    end None significa fino alla fine del file.
+    I dati prima dell'offset di una voce sono stati scritti prima del suo
+    timestamp, quelli dopo non prima: la precisione e' quella dell'indice.
+    """
+    times = [ts for ts, _ in entries]
+    start, end = 0, None
+    if since is not None:
+        i = bisect.bisect_right(times, since) - 1
+        if i >= 0:
+            start = entries[i][1]
+    if until is not None:
+        i = bisect.bisect_right(times, until)
+        if i < len(entries):
+            end = entries[i][1]
+    return start, end
+
+
+def _open(segment):
+    return gzip.open(segment, 'rb') if segment.endswith('.gz') else open(segment, 'rb')
+
+
+def _scan(segment, start, end, regex):
+    with _open(segment) as f:
+        if start:
+            # Su un file compresso seek decomprime fino all'offset senza fare match
+            f.seek(start)
+        pos = start
+        for line in f:
+            if end is not None and pos >= end:
+                break
+            pos += len(line)
+            if regex is None or regex.search(line):
+                yield line.decode(errors='replace')
+
+
+def search(path, pattern=None, since=None, until=None, ignore_case=False):
+    """
+    Righe del log path e dei suoi file ruotati (anche compressi), dal piu'
+    vecchio al piu' recente, che contengono la regex pattern e sono state
+    scritte tra since e until (timestamp).
+    Con l'indice (log catturati dal backend) si legge solo la parte di file
+    nell'intervallo; i file senza indice (processi nohup) vengono esclusi
+    solo se l'ultima scrittura e' precedente a since.
+    """
+    regex = re.compile(pattern.encode(), re.IGNORECASE if ignore_case else 0) if pattern else None
+    for segment in list(reversed(rotated_files(path))) + [str(path)]:
+        try:
+            st = os.stat(segment)
+        except FileNotFoundError:
+            continue
+        if since is not None and st.st_mtime < since:
+            continue
+        entries = read_index(segment)
+        if until is not None and entries and entries[0][0] > until:
+            # Questo segmento e i successivi sono tutti dopo until
+            break
+        start, end = byte_range(entries, since, until)
+        if not segment.endswith('.gz') and start > st.st_size:
+            # Indice non piu' valido (file svuotato)
+            start, end = 0, None
+        yield from _scan(segment, start, end, regex)
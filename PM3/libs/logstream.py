@@ -0,0 +1,176 @@
+import os
+import time
+import selectors
+from pathlib import Path
+from PM3.libs.logtail import tail
+from PM3.libs import logindex
+from PM3.libs.inotify import (Inotify, IN_MODIFY, IN_CLOSE_WRITE, IN_MOVED_FROM, IN_MOVED_TO,
+                              IN_CREATE, IN_DELETE, IN_Q_OVERFLOW)
+
+READ_SIZE = 64 * 1024
+MAX_LINE = 1024 * 1024
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+
+class FollowedFile:
+    """
+    Un file di log seguito dalla posizione corrente.
+    read() genera le nuove righe complete e segue rotazioni
+    (nuovo inode: finisco il vecchio file e riparto dall'inizio del nuovo)
+    e troncamenti (pm3 flush: riparto da zero).
+    """
+    def __init__(self, prefix, path):
+        self.prefix = prefix
+        self.path = path
+        self.partial = b''
+        self.f = None
+        self._open(at_end=True)
+
+    def _open(self, at_end):
+        try:
+            self.f = open(self.path, 'rb')
+        except FileNotFoundError:
+            self.f = None
+            return
+        if at_end:
+            self.f.seek(0, os.SEEK_END)
+
+    def _lines(self, data):
+        data = self.partial + data
+        *complete, self.partial = data.split(b'\n')
+        if len(self.partial) > MAX_LINE:
+            # Riga troppo lunga: la spezzo
+            complete.append(self.partial)
+            self.partial = b''
+        return [self.prefix + line.decode(errors='replace') + '\n' for line in complete]
+
+    def _read_available(self):
+        # A blocchi: se il client e' lento il generatore resta fermo e
+        # i dati aspettano su disco, non in memoria
+        while True:
+            chunk = self.f.read(READ_SIZE)
+            if not chunk:
+                return
+            lines = self._lines(chunk)
+            if lines:
+                yield lines
+
+    def read(self):
+        if self.f is None:
+            # File creato dopo l'inizio del follow
+            self._open(at_end=False)
+            if self.f is None:
+                return
+        yield from self._read_available()
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            st = None
+        if st is None or st.st_ino != os.fstat(self.f.fileno()).st_ino:
+            # Ruotato o cancellato
+            if self.partial:
+                yield self._lines(b'\n')
+            self.f.close()
+            self._open(at_end=False)
+            if self.f is not None:
+                yield from self._read_available()
+        elif st.st_size < self.f.tell():
+            # Troncato
+            self.f.seek(0)
+            self.partial = b''
+            yield from self._read_available()
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+
+def stream(sources, lines=10, follow=False, heartbeat=15, poll_interval=1):
+    """
+    Log di piu' file in un unico flusso.
+    sources: lista di (prefisso, path)
+    Genera liste di righe gia' prefissate: prima le ultime `lines` righe di
+    ogni file, poi (follow=True) le nuove righe di tutti i file man mano
+    che vengono scritte, mescolate riga per riga.
+    Il follow e' guidato da inotify sulle directory dei file (rotazioni
+    comprese); senza inotify si controllano i file ogni poll_interval secondi.
+    Con follow genera una lista vuota ogni heartbeat secondi senza dati.
+    """
+    # Apro i file prima del tail: le righe scritte nel frattempo non vanno perse
+    files = [FollowedFile(prefix, path) for prefix, path in sources] if follow else []
+    try:
+        for prefix, path in sources:
+            if lines > 0 and Path(path).is_file():
+                yield [prefix + line if line.endswith('\n') else prefix + line + '\n'
+                       for line in tail(path, lines)]
+        if not follow:
+            return
+
+        try:
+            notify = Inotify()
+        except OSError:
+            notify = None
+        # Selector e non select.select: con migliaia di pipe catturate i numeri
+        # dei descrittori superano FD_SETSIZE (1024)
+        selector = selectors.DefaultSelector()
+        try:
+            watched = {}        # wd -> {nome file: [FollowedFile]}
+            if notify is not None:
+                selector.register(notify, selectors.EVENT_READ)
+                for ff in files:
+                    path = Path(ff.path)
+                    try:
+                        wd = notify.add_watch(path.parent, WATCH_MASK)
+                    except OSError:
+                        continue
+                    watched.setdefault(wd, {}).setdefault(path.name, []).append(ff)
+
+            last_output = time.monotonic()
+            while True:
+                if notify is not None:
+                    ready = selector.select(heartbeat)
+                    changed = []
+                    for wd, mask, name in (notify.read() if ready else []):
+                        if mask & IN_Q_OVERFLOW:
+                            changed = files
+                            break
+                        for ff in watched.get(wd, {}).get(name, []):
+                            if ff not in changed:
+                                changed.append(ff)
+                else:
+                    time.sleep(poll_interval)
+                    changed = files
+
+                for ff in changed:
+                    for block in ff.read():
+                        last_output = time.monotonic()
+                        yield block
+                if time.monotonic() - last_output >= heartbeat:
+                    # Nessun dato da heartbeat secondi
+                    last_output = time.monotonic()
+                    yield []
+        finally:
+            selector.close()
+            if notify is not None:
+                notify.close()
+    finally:
+        for ff in files:
+            ff.close()
+
+
+def search(sources, pattern=None, since=None, until=None, ignore_case=False, batch=256):
+    """
+    Ricerca nei log di piu' file (vedi logindex.search), un file alla volta.
+    Genera liste di al massimo batch righe gia' prefissate.
+    """
+    for prefix, path in sources:
+        block = []
+        for line in logindex.search(path, pattern, since, until, ignore_case):
+            block.append(prefix + line if line.endswith('\n') else prefix + line + '\n')
+            if len(block) >= batch:
+                yield block
+                block = []
+        if block:
+            yield block
@@ -0,0 +1,84 @@
+import os
+import gzip
+from collections import deque
+from pathlib import Path
+
+BLOCK_SIZE = 64 * 1024
+
+
+def rotated_files(path):
+    """
+    File ruotati di path (path.1, path.2.gz, ...), dal piu' recente
+    al piu' vecchio. I file compressi terminano con .gz
+    """
+    path = Path(path)
+    prefix = f'{path.name}.'
+    found = {}
+    try:
+        with os.scandir(path.parent) as it:
+            for entry in it:
+                if not entry.name.startswith(prefix):
+                    continue
+                n = entry.name[len(prefix):]
+                compressed = n.endswith('.gz')
+                n = n[:-3] if compressed else n
+                if n.isdigit() and not (compressed and int(n) in found):
+                    # Durante la compressione esistono entrambi: vale quello in chiaro
+                    found[int(n)] = entry.path
+    except FileNotFoundError:
+        return []
+    return [found[n] for n in sorted(found)]
+
+
+def _tail_gz(path, n):
+    # Un file compresso non si legge all'indietro: lo scorro tenendo n righe
+    with gzip.open(path, 'rb') as f:
+        return list(deque(f, maxlen=n))
+
+
+def _tail_file(path, n, block_size=BLOCK_SIZE):
+    # Ultime n righe (bytes) leggendo a blocchi dalla fine del file:
+    # mi fermo appena ho n+1 newline, cosi' la prima riga e' completa
+    if n <= 0:
+        return []
+    if str(path).endswith('.gz'):
+        return _tail_gz(path, n)
+    chunks = []
+    newlines = 0
+    with open(path, 'rb') as f:
+        pos = f.seek(0, os.SEEK_END)
+        while pos > 0 and newlines <= n:
+            size = min(block_size, pos)
+            pos -= size
+            f.seek(pos)
+            chunk = f.read(size)
+            chunks.append(chunk)
+            newlines += chunk.count(b'\n')
+    lines = b''.join(reversed(chunks)).splitlines(keepends=True)
+    if pos > 0:
+        # La prima riga e' iniziata prima del blocco letto
+        lines = lines[1:]
+    return lines[-n:]
+
+
+def tail(path, n=10, rotated=True, block_size=BLOCK_SIZE):
+    """
+    Ultime n righe di un file di log, senza leggerlo tutto:
+    la memoria usata dipende da n e non dalla dimensione del file.
+    Se il file ha meno di n righe (rotated=True) si prosegue nei file
+    ruotati path.1, path.2, ...
+    """
+    segments = [path] + (rotated_files(path) if rotated else [])
+    lines = []
+    for segment in segments:
+        if len(lines) >= n:
+            break
+        try:
+            older = _tail_file(segment, n - len(lines) + 1, block_size)
+        except FileNotFoundError:
+            continue
+        if older and lines and not older[-1].endswith(b'\n'):
+            # Riga spezzata dalla rotazione
+            lines[0] = older.pop() + lines[0]
+        lines = older + lines
+    return [line.decode(errors='replace') for line in lines[-n:]]
@@ -0,0 +1,62 @@
+import threading
+import time
+from collections import deque
+
+
+class MonitFeed:
+    """
+    Vista condivisa di pm3 monit: una riga per processo, ricostruita al piu'
+    una volta per ogni nuovo campione del sampler o modifica del registro
+    (key() cambia), qualunque sia il numero dei client collegati.
+    Ogni riga ricorda la generazione in cui e' cambiata: delta(since)
+    restituisce solo le righe cambiate e gli id rimossi dopo since.
+    build() deve restituire un dict pm3_id -> riga (dict serializzabile).
+    """
+    def __init__(self, build, key, removed_size=4096):
+        self.build = build
+        self.key = key
+        self.lock = threading.Lock()
+        # Le generazioni partono dal tempo in ms: crescono molto meno di 1000
+        # al secondo, cosi' un client collegato a un backend precedente ha
+        # since < _floor e riceve tutte le righe
+        self.generation = int(time.time() * 1000)
+        self._key = None
+        self._rows = {}                             # pm3_id -> (riga, generazione)
+        self._removed = deque(maxlen=removed_size)  # (generazione, pm3_id)
+        self._floor = self.generation   # generazione piu' vecchia coperta da _removed
+
+    def update(self):
+        key = self.key()
+        with self.lock:
+            if key == self._key:
+                return self.generation
+            rows = self.build()
+            self.generation += 1
+            gen = self.generation
+            for pm3_id, row in rows.items():
+                old = self._rows.get(pm3_id)
+                if old is None or old[0] != row:
+                    self._rows[pm3_id] = (row, gen)
+            for pm3_id in [i for i in self._rows if i not in rows]:
+                del self._rows[pm3_id]
+                if len(self._removed) == self._removed.maxlen:
+                    self._floor = self._removed[0][0]
+                self._removed.append((gen, pm3_id))
+            self._key = key
+            return gen
+
+    def delta(self, since=0):
+        """
+        {'gen', 'full', 'rows', 'removed'}: con full=True rows sono tutte le
+        righe (primo collegamento, backend riavviato o rimozioni non piu'
+        in memoria) e il client deve dimenticare quelle che aveva.
+        """
+        with self.lock:
+            full = since <= 0 or since > self.generation or since < self._floor
+            if full:
+                rows = [row for row, _ in self._rows.values()]
+                removed = []
+            else:
+                rows = [row for row, gen in self._rows.values() if gen > since]
+                removed = [pm3_id for gen, pm3_id in self._removed if gen > since]
+            return {'gen': self.generation, 'full': full, 'rows': rows, 'removed': removed}
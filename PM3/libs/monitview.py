@@ -0,0 +1,238 @@
+import os
+import sys
+import json
+import time
+import queue
+import select
+import threading
+from rich import box
+from rich.console import Console, Group
+from rich.live import Live
+from rich.table import Table
+from rich.text import Text
+from PM3.libs.client import BackendError
+
+# Tasti di ordinamento (ripetuto inverte l'ordine)
+SORT_KEYS = {'i': 'pm3_id', 'n': 'pm3_name', 'c': 'cpu', 'm': 'mem', 'r': 'restart', 'u': 'create_time'}
+# Metriche: ordinate dalla piu' alta
+DESCENDING = ('cpu', 'mem', 'restart')
+COLUMNS = ('id', 'name', 'pid', 'status', 'cpu %', 'mem %', 'rss', 'threads', 'children', 'uptime', 'restart', 'autorun')
+# Frecce e pagina su/giu'
+ESCAPES = {'\x1b[A': 'k', '\x1b[B': 'j', '\x1b[5~': 'K', '\x1b[6~': 'J'}
+STATUS_STYLE = {'running': 'green', 'sleeping': 'green', 'disk-sleep': 'yellow', 'starting': 'yellow',
+                'stopped': 'red', 'zombie': 'bold red blink'}
+AUTORUN_STYLE = {'enabled': 'green', 'suspended': 'yellow', 'disabled': 'red'}
+
+
+def _bytes(v):
+    for unit in ('B', 'K', 'M', 'G'):
+        if abs(v) < 1024:
+            return f'{v:.1f}{unit}'
+        v /= 1024
+    return f'{v:.1f}T'
+
+def _uptime(create_time, now):
+    if create_time is None:
+        return '-'
+    s = int(max(now - create_time, 0))
+    d, s = divmod(s, 86400)
+    h, s = divmod(s, 3600)
+    m, s = divmod(s, 60)
+    if d:
+        return f'{d}d {h}h'
+    if h:
+        return f'{h}h {m}m'
+    if m:
+        return f'{m}m {s}s'
+    return f'{s}s'
+
+
+class MonitView:
+    """
+    Stato di pm3 monit: le righe ricevute dal backend (prima tutte, poi solo
+    quelle cambiate), ordinamento, filtro e scorrimento. render() costruisce
+    solo le righe visibili e riusa le celle delle righe non cambiate.
+    """
+    def __init__(self):
+        self.rows = {}              # pm3_id -> riga
+        self.gen = 0                # ultima generazione ricevuta
+        self.sort = 'pm3_id'
+        self.reverse = False
+        self.filter = ''
+        self.typing = False         # sto scrivendo il filtro
+        self.running_only = False
+        self.offset = 0
+        self.status = 'connecting'
+        self.updated = None
+        self._cells = {}            # pm3_id -> (riga, celle)
+
+    def apply(self, delta):
+        if delta['full']:
+            self.rows.clear()
+            self._cells.clear()
+        for row in delta['rows']:
+            self.rows[row['pm3_id']] = row
+        for pm3_id in delta['removed']:
+            self.rows.pop(pm3_id, None)
+            self._cells.pop(pm3_id, None)
+        self.gen = delta['gen']
+        self.updated = time.time()
+        self.status = 'connected'
+
+    def key(self, ch, page=20):
+        # False per uscire
+        if self.typing:
+            if ch in ('\r', '\n'):
+                self.typing = False
+            elif ch == '\x1b':
+                self.filter, self.typing = '', False
+            elif ch in ('\x7f', '\b'):
+                self.filter = self.filter[:-1]
+            elif ch.isprintable():
+                self.filter += ch
+            self.offset = 0
+            return True
+        if ch == 'q':
+            return False
+        if ch in SORT_KEYS:
+            sort = SORT_KEYS[ch]
+            if sort == self.sort:
+                self.reverse = not self.reverse
+            else:
+                self.sort, self.reverse = sort, sort in DESCENDING
+        elif ch == '/':
+            self.typing = True
+        elif ch == 'a':
+            self.running_only = not self.running_only
+            self.offset = 0
+        elif ch in ('j', 'k', 'J', 'K'):
+            self.offset += {'j': 1, 'k': -1, 'J': page, 'K': -page}[ch]
+        elif ch == 'g':
+            self.offset = 0
+        return True
+
+    def visible(self):
+        rows = self.rows.values()
+        if self.filter:
+            f = self.filter.lower()
+            rows = [r for r in rows if f in r['pm3_name'].lower() or f == str(r['pm3_id'])]
+        if self.running_only:
+            rows = [r for r in rows if r['pid']]
+        # I valori mancanti (uptime dei processi fermi) sempre in fondo
+        present = [r for r in rows if r[self.sort] is not None]
+        missing = [r for r in rows if r[self.sort] is None]
+        return sorted(present, key=lambda r: r[self.sort], reverse=self.reverse) + missing
+
+    def _row_cells(self, r):
+        cached = self._cells.get(r['pm3_id'])
+        if cached is None or cached[0] is not r:
+            status = r['status']
+            autorun = r['autorun']
+            cells = [str(r['pm3_id']), r['pm3_name'], str(r['pid'] or '-'),
+                     Text(status, style=STATUS_STYLE.get(status, '')),
+                     f"{r['cpu']:.1f}", f"{r['mem']:.1f}", _bytes(r['rss']),
+                     str(r['threads']), str(r['children']), None, str(r['restart']),
+                     Text(autorun, style=AUTORUN_STYLE.get(autorun, ''))]
+            cached = (r, cells)
+            self._cells[r['pm3_id']] = cached
+        return cached[1]
+
+    def render(self, height):
+        rows = self.visible()
+        page = max(height - 7, 1)       # intestazione, bordi e piede
+        self.offset = max(0, min(self.offset, len(rows) - page))
+        now = time.time()
+
+        table = Table(box=box.SIMPLE_HEAD, header_style='bold green', expand=True, pad_edge=False)
+        for col in COLUMNS:
+            table.add_column(col, no_wrap=True, overflow='ellipsis',
+                             justify='left' if col in ('name', 'status', 'autorun') else 'right')
+        for r in rows[self.offset:self.offset + page]:
+            cells = list(self._row_cells(r))
+            cells[9] = _uptime(r['create_time'], now)
+            table.add_row(*cells)
+
+        running = [r for r in self.rows.values() if r['pid']]
+        order = 'desc' if self.reverse else 'asc'
+        head = Text.assemble(
+            ('pm3 monit', 'bold cyan'),
+            f"  {len(self.rows)} processes, {len(running)} running"
+            f"  cpu {sum(r['cpu'] for r in running):.1f}%  mem {sum(r['mem'] for r in running):.1f}%"
+            f"  rss {_bytes(sum(r['rss'] for r in running))}  sort {self.sort} {order}",
+            (f'  filter /{self.filter}' + ('_' if self.typing else ''), 'yellow') if self.filter or self.typing else '',
+            ('  running only', 'yellow') if self.running_only else '',
+            (f'  [{self.status}]', 'green' if self.status == 'connected' else 'red'))
+        shown = f'{self.offset + 1}-{min(self.offset + page, len(rows))} of {len(rows)}' if rows else '0 of 0'
+        foot = Text(f'{shown}   q quit  i/n/c/m/r/u sort (again: reverse)  / filter  a running only  '
+                    f'j/k/arrows/PgUp/PgDn scroll  g top', style='dim')
+        return Group(head, table, foot)
+
+
+def _reader(client, view, events, stop, interval):
+    # Un solo collegamento al backend: riceve le righe cambiate,
+    # se cade si ricollega con l'ultima generazione ricevuta
+    while not stop.is_set():
+        try:
+            params = {'since': view.gen, 'interval': interval}
+            with client.stream('monit', params=params, headers={'Accept': 'text/event-stream'}) as r:
+                if not r.getheader('Content-Type', '').startswith('text/event-stream'):
+                    events.put(('error', json.loads(r.read()).get('msg', f'http {r.status}')))
+                else:
+                    for line in r:
+                        if stop.is_set():
+                            return
+                        if line.startswith(b'data: '):
+                            events.put(('delta', json.loads(line[6:])))
+                    events.put(('error', 'disconnected'))
+        except (BackendError, OSError, ValueError) as e:
+            events.put(('error', str(e) or e.__class__.__name__))
+        stop.wait(1)
+
+
+def monit(client, interval=1):
+    view = MonitView()
+    events = queue.Queue()
+    stop = threading.Event()
+    threading.Thread(target=_reader, args=(client, view, events, stop, interval), daemon=True).start()
+
+    console = Console()
+    fd = sys.stdin.fileno() if sys.stdin.isatty() else None
+    if fd is not None:
+        import termios
+        import tty
+        old_attrs = termios.tcgetattr(fd)
+        tty.setcbreak(fd)
+    try:
+        with Live(console=console, screen=True, auto_refresh=False) as live:
+            dirty, drawn = True, 0
+            while True:
+                while True:
+                    try:
+                        kind, data = events.get_nowait()
+                    except queue.Empty:
+                        break
+                    if kind == 'delta':
+                        view.apply(data)
+                    else:
+                        view.status = data
+                    dirty = True
+                if dirty or time.monotonic() - drawn >= 1:
+                    # Almeno una volta al secondo per l'uptime
+                    live.update(view.render(console.size.height), refresh=True)
+                    dirty, drawn = False, time.monotonic()
+                if fd is None:
+                    time.sleep(0.1)
+                    continue
+                if select.select([fd], [], [], 0.1)[0]:
+                    chunk = os.read(fd, 32).decode(errors='ignore')
+                    keys = ESCAPES[chunk] if chunk in ESCAPES else chunk
+                    for ch in keys:
+                        if not view.key(ch, page=max(console.size.height - 7, 1)):
+                            return
+                    dirty = True
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        if fd is not None:
+            termios.tcsetattr(fd, termios.TCSADRAIN, old_attrs)
@@ -0,0 +1,152 @@
+import os
+import json
+import sqlite3
+import tempfile
+from pathlib import Path
+from tinydb.storages import Storage
+
+
+class AtomicJSONStorage(Storage):
+    """
+    TinyDB storage che riscrive il file json in modo atomico
+    (file temporaneo + rename): un crash durante la scrittura
+    non lascia mai il db troncato.
+    """
+    def __init__(self, path, **kwargs):
+        super().__init__()
+        self.path = Path(path)
+        self.kwargs = kwargs
+
+    def read(self):
+        try:
+            with open(self.path, 'r') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if not data:
+            return None
+        return json.loads(data)
+
+    def write(self, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix=f'.{self.path.name}.')
+        try:
+            # mkstemp crea il file con 0600: mantengo i permessi del db
+            os.chmod(tmp_path, self.path.stat().st_mode if self.path.exists() else 0o644)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f, **self.kwargs)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+    def close(self):
+        pass
+
+
+class TinyDBStore:
+    """
+    Store su file json in formato TinyDB ({table: {doc_id: row}}).
+    Tutte le modifiche di un flush diventano una sola scrittura del file.
+    """
+    def __init__(self, path, table):
+        self.storage = AtomicJSONStorage(path)
+        self.table = table
+        self._data = self.storage.read() or {}
+        self._docs = self._data.setdefault(table, {})
+        self._doc_ids = {row['pm3_id']: doc_id for doc_id, row in self._docs.items()}
+        self._next_doc_id = max([int(i) for i in self._docs], default=0) + 1
+
+    def all(self):
+        return [dict(row) for row in self._docs.values()]
+
+    def write(self, rows, deleted):
+        for pm3_id in deleted:
+            doc_id = self._doc_ids.pop(pm3_id, None)
+            if doc_id is not None:
+                self._docs.pop(doc_id, None)
+
+        for row in rows:
+            doc_id = self._doc_ids.get(row['pm3_id'])
+            if doc_id is None:
+                doc_id = str(self._next_doc_id)
+                self._next_doc_id += 1
+                self._doc_ids[row['pm3_id']] = doc_id
+            self._docs[doc_id] = dict(row)
+
+        self.storage.write(self._data)
+
+    def close(self):
+        self.storage.close()
+
+
+class SQLiteStore:
+    """
+    Store su SQLite in modalita' WAL: ogni flush e' una transazione
+    con aggiornamenti puntuali sulle sole righe modificate.
+    La riga completa e' salvata in json nella colonna data, le colonne
+    pm3_id/pm3_name/autorun sono indicizzate.
+    """
+    def __init__(self, path, table, migrate_from=None):
+        self.path = Path(path)
+        self.table = table
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        with self.conn:
+            self.conn.execute('BEGIN')
+            self.conn.execute(f'CREATE TABLE IF NOT EXISTS "{table}" ('
+                              'pm3_id INTEGER PRIMARY KEY, '
+                              'pm3_name TEXT NOT NULL, '
+                              'autorun INTEGER NOT NULL DEFAULT 0, '
+                              'data TEXT NOT NULL)')
+            self.conn.execute(f'CREATE INDEX IF NOT EXISTS "{table}_pm3_name" ON "{table}" (pm3_name)')
+            self.conn.execute(f'CREATE INDEX IF NOT EXISTS "{table}_autorun" ON "{table}" (autorun)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS pm3_meta (key TEXT PRIMARY KEY, value TEXT)')
+        if migrate_from:
+            self.migrate(migrate_from)
+
+    def migrate(self, json_path):
+        # Import una tantum dal vecchio pm3_db.json (TinyDB)
+        key = f'migrated:{self.table}'
+        if self.conn.execute('SELECT 1 FROM pm3_meta WHERE key=?', (key,)).fetchone():
+            return 0
+        rows = []
+        if Path(json_path).is_file():
+            rows = TinyDBStore(json_path, self.table).all()
+        with self.conn:
+            self.conn.execute('BEGIN')
+            self._upsert(rows)
+            self.conn.execute('INSERT INTO pm3_meta VALUES (?, ?)', (key, Path(json_path).as_posix()))
+        return len(rows)
+
+    def all(self):
+        return [json.loads(i[0]) for i in self.conn.execute(f'SELECT data FROM "{self.table}"')]
+
+    def _upsert(self, rows):
+        self.conn.executemany(f'INSERT OR REPLACE INTO "{self.table}" VALUES (?, ?, ?, ?)',
+                              [(i['pm3_id'], i['pm3_name'], int(bool(i.get('autorun'))), json.dumps(i))
+                               for i in rows])
+
+    def write(self, rows, deleted):
+        with self.conn:
+            self.conn.execute('BEGIN')
+            self.conn.executemany(f'DELETE FROM "{self.table}" WHERE pm3_id=?', [(i,) for i in deleted])
+            self._upsert(rows)
+
+    def close(self):
+        self.conn.close()
+
+
+def make_store(main_section):
+    # Motore di storage scelto con pm3_db_engine (tinydb o sqlite)
+    engine = main_section.get('pm3_db_engine', 'tinydb').lower()
+    table = main_section.get('pm3_db_process_table')
+    if engine == 'tinydb':
+        return TinyDBStore(main_section.get('pm3_db'), table)
+    elif engine == 'sqlite':
+        home = main_section.get('pm3_home_dir')
+        path = main_section.get('pm3_db_sqlite', f'{home}/pm3_db.sqlite')
+        return SQLiteStore(path, table, migrate_from=main_section.get('pm3_db'))
+    raise ValueError(f'unknown pm3_db_engine: {engine}')
@@ -1,13 +1,78 @@
 from PM3.model.pm3_protocol import ION
-from PM3.model.process import Process
-from tinydb import where
+from PM3.model.process import Process, ProcessRecord
+from pydantic import ValidationError
+import threading
+import logging
+import time
 
 def hidden_proc(x: str) -> bool:
     return x.startswith('__') and x.endswith('__')
 
 class Pm3Table:
-    def __init__(self, tbl):
-        self.tbl = tbl
+    # Registro in memoria sopra lo store su disco:
+    # le letture non toccano mai il disco, le scritture aggiornano
+    # gli indici e marcano le righe come dirty; flush() le salva
+    # tutte insieme (write-behind).
+    def __init__(self, store):
+        self.store = store
+        self.lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._dirty = set()         # pm3_id da scrivere
+        self._deleted = set()       # pm3_id da cancellare
+        self.version = 0            # incrementato ad ogni modifica del registro
+        self.stats = dict(flushes=0, rows_written=0, rows_deleted=0, flush_errors=0, last_flush=None)
+        self._rows = {}             # pm3_id -> row
+        self._by_name = {}          # pm3_name -> pm3_id
+        self._hidden = set()
+        self._autorun_only = set()
+        self._autorun_enabled = set()
+        self._max_id = None
+        self.reload()
+
+    def reload(self):
+        with self.lock:
+            self._rows.clear()
+            self._by_name.clear()
+            self._hidden.clear()
+            self._autorun_only.clear()
+            self._autorun_enabled.clear()
+            self._max_id = None
+            self._dirty.clear()
+            self._deleted.clear()
+            for row in self.store.all():
+                # Unica validazione delle righe su disco (righe vecchie
+                # completate con i default): le letture usano ProcessRecord
+                try:
+                    self._index(Process(**row).dict())
+                except ValidationError as e:
+                    logging.error(f'invalid row {dict(row)} skipped: {e}')
+
+    def _index(self, row):
+        pm3_id = row['pm3_id']
+        self._rows[pm3_id] = row
+        self._by_name[row['pm3_name']] = pm3_id
+        if hidden_proc(row['pm3_name']):
+            self._hidden.add(pm3_id)
+        if row['autorun'] is True:
+            self._autorun_only.add(pm3_id)
+            if row['autorun_exclude'] is False:
+                self._autorun_enabled.add(pm3_id)
+        if self._max_id is None or pm3_id > self._max_id:
+            self._max_id = pm3_id
+
+    def _unindex(self, pm3_id, update_max=True, keep_slot=False):
+        # keep_slot: la riga resta in _rows e _index la sostituisce nella
+        # stessa posizione (l'ordine di ls e di all non cambia)
+        row = self._rows[pm3_id] if keep_slot else self._rows.pop(pm3_id)
+        if self._by_name.get(row['pm3_name']) == pm3_id:
+            del self._by_name[row['pm3_name']]
+        self._hidden.discard(pm3_id)
+        self._autorun_only.discard(pm3_id)
+        self._autorun_enabled.discard(pm3_id)
+        if update_max and pm3_id == self._max_id:
+            # Solo in questo caso serve ricalcolare il massimo
+            self._max_id = max(self._rows) if self._rows else None
+        return row
 
     def next_id(self, start_from=None):
         if start_from:
@@ -17,79 +82,174 @@ class Pm3Table:
                 pm3_id += 1
             return pm3_id
         else:
-            if len(self.tbl.all()) > 0:
-                return max([i['pm3_id'] for i in self.tbl.all()])+1
+            if self._max_id is not None:
+                return self._max_id + 1
             else:
                 return 1
 
     def check_exist(self, val, col='pm3_id'):
-        return self.tbl.contains(where(col) == val)
+        if col == 'pm3_id':
+            return val in self._rows
+        elif col == 'pm3_name':
+            return val in self._by_name
+        return any(row.get(col) == val for row in self._rows.values())
+
+    def _get(self, val, col='pm3_id'):
+        if col == 'pm3_name':
+            val = self._by_name.get(val)
+            col = 'pm3_id'
+        if col == 'pm3_id':
+            return self._rows.get(val)
+        for row in self._rows.values():
+            if row.get(col) == val:
+                return row
+        return None
+
+    def get(self, pm3_id):
+        # Process aggiornato per pm3_id (None se non esiste), per start/stop/reset.
+        # La riga e' gia' valida: construct() non rivalida
+        row = self._rows.get(pm3_id)
+        return Process.construct(**row) if row else None
+
+    def record(self, pm3_id):
+        # Come get() ma in sola lettura (ProcessRecord)
+        row = self._rows.get(pm3_id)
+        return ProcessRecord(row) if row else None
 
     def select(self, proc, col='pm3_id'):
-        return self.tbl.get(where(col) == proc.dict()[col])
+        return self._get(proc.dict()[col], col)
 
-    def delete(self, proc, col='pm3_id'):
-        if self.select(proc, col):
-            self.tbl.remove(where(col) == proc.dict()[col])
+    def insert(self, proc):
+        row = proc.dict()
+        with self.lock:
+            if row['pm3_id'] in self._rows or row['pm3_name'] in self._by_name:
+                return False
+            self._index(row)
+            self._dirty.add(row['pm3_id'])
+            self._deleted.discard(row['pm3_id'])
+            self.version += 1
             return True
-        else:
-            return False
+
+    def delete(self, proc, col='pm3_id'):
+        with self.lock:
+            row = self.select(proc, col)
+            if row:
+                self._unindex(row['pm3_id'])
+                self._dirty.discard(row['pm3_id'])
+                self._deleted.add(row['pm3_id'])
+                self.version += 1
+                return True
+            else:
+                return False
 
     def update(self, proc, col='pm3_id'):
-        if self.select(proc, col):
-            self.tbl.update(proc, where(col) == proc.dict()[col])
+        with self.lock:
+            old_row = self.select(proc, col)
+            if old_row:
+                row = {**old_row, **proc.dict()}
+                if row == old_row:
+                    # Niente da scrivere
+                    return True
+                self._unindex(old_row['pm3_id'], update_max=False,
+                              keep_slot=row['pm3_id'] == old_row['pm3_id'])
+                self._index(row)
+                self._dirty.add(row['pm3_id'])
+                self.version += 1
+                return True
+            else:
+                return False
+
+    def __len__(self):
+        with self.lock:
+            return len(self._rows)
+
+    def rows(self):
+        # Righe del registro in sola lettura (nessun Process costruito)
+        with self.lock:
+            return list(self._rows.values())
+
+    def running(self):
+        # (pm3_id, pid) dei processi con un pid assegnato
+        with self.lock:
+            return [(i['pm3_id'], i['pid']) for i in self._rows.values() if i['pid'] > 0]
+
+    @property
+    def dirty(self):
+        return len(self._dirty) + len(self._deleted)
+
+    def flush(self):
+        # Una sola scrittura atomica per tutte le righe modificate
+        with self._flush_lock:
+            with self.lock:
+                if not self._dirty and not self._deleted:
+                    return False
+                rows = [dict(self._rows[i]) for i in self._dirty]
+                deleted = list(self._deleted)
+                self._dirty.clear()
+                self._deleted.clear()
+            try:
+                self.store.write(rows, deleted)
+            except Exception:
+                with self.lock:
+                    # Riprovo al prossimo flush
+                    self._dirty.update(i['pm3_id'] for i in rows if i['pm3_id'] in self._rows)
+                    self._deleted.update(i for i in deleted if i not in self._rows)
+                    self.stats['flush_errors'] += 1
+                raise
+            self.stats['flushes'] += 1
+            self.stats['rows_written'] += len(rows)
+            self.stats['rows_deleted'] += len(deleted)
+            self.stats['last_flush'] = time.time()
             return True
+
+    def _procs(self, ids=None, exclude=None):
+        # Sempre nell'ordine del registro, qualunque sia il selettore
+        if ids is None:
+            rows = self._rows.values()
         else:
-            return False
+            rows = [r for i, r in self._rows.items() if i in ids]
+        if exclude:
+            rows = [i for i in rows if i['pm3_id'] not in exclude]
+        return [ProcessRecord(i) for i in rows]
 
     def find_id_or_name(self, id_or_name, hidden=False) -> ION:
+        with self.lock:
+            return self._find_id_or_name(id_or_name)
+
+    def _find_id_or_name(self, id_or_name) -> ION:
         if id_or_name == 'all':
             # Tutti (nascosti esclusi)
-            out = ION('special',
-                      id_or_name,
-                      [Process(**i) for i in self.tbl.all() if not hidden_proc(i['pm3_name'])]
-                      )
-            return out
+            return ION('special', id_or_name, self._procs(exclude=self._hidden))
 
         elif id_or_name == 'ALL':
             # Proprio tutti (compresi i nascosti)
-            out = ION('special', id_or_name, [Process(**i) for i in self.tbl.all()])
-            return out
+            return ION('special', id_or_name, self._procs())
 
         elif id_or_name == 'hidden_only':
             # Solo i nascosti (nascosti esclusi)
-            out = ION('special',
-                      id_or_name,
-                      [Process(**i) for i in self.tbl.all() if hidden_proc(i['pm3_name'])]
-                      )
-            return out
+            return ION('special', id_or_name, self._procs(self._hidden))
 
         elif id_or_name == 'autorun_only':
             # Tutti gli autorun (compresi i sospesi)
-            out = ION('special',
-                      id_or_name,
-                      [Process(**i) for i in self.tbl.all() if i['autorun'] is True])
-            return out
+            return ION('special', id_or_name, self._procs(self._autorun_only))
+
         elif id_or_name == 'autorun_enabled':
             # Gruppo di autorun non sospesi
-            out = ION('special',
-                      id_or_name,
-                      [Process(**i) for i in self.tbl.all() if i['autorun'] is True and i['autorun_exclude'] is False])
-            return out
+            return ION('special', id_or_name, self._procs(self._autorun_enabled))
 
         try:
             id_or_name = int(id_or_name)
         except ValueError:
-            if self.check_exist(id_or_name, col='pm3_name'):
-                p_data = self.tbl.get(where('pm3_name') == id_or_name)
-                out = ION('pm3_name', id_or_name, [Process(**p_data), ])
+            p_data = self._get(id_or_name, col='pm3_name')
+            if p_data:
+                out = ION('pm3_name', id_or_name, [ProcessRecord(p_data), ])
             else:
                 out = ION('pm3_name', id_or_name, [])
 
         else:
-            if self.check_exist(id_or_name, col='pm3_id'):
-                p_data = self.tbl.get(where('pm3_id') == id_or_name)
-                out = ION('pm3_id', id_or_name, [Process(**p_data), ])
+            p_data = self._get(id_or_name, col='pm3_id')
+            if p_data:
+                out = ION('pm3_id', id_or_name, [ProcessRecord(p_data), ])
             else:
                 out = ION('pm3_id', id_or_name, [])
         return out
@@ -0,0 +1,43 @@
+import psutil
+
+# Dati letti da /proc/<pid>/stat durante la scansione
+TREE_ATTRS = ['pid', 'ppid', 'name', 'status', 'create_time']
+
+
+class ProcTree:
+    """
+    Fotografia dell'albero dei processi del sistema costruita con una
+    sola scansione di /proc: pid -> figli e dati di stat per ogni pid.
+    Va condivisa tra tutti i processi di una stessa richiesta /ps,
+    di un campione del sampler o di uno stop multiplo, invece di chiamare
+    psutil.Process(pid).children(recursive=True) per ognuno.
+    """
+    def __init__(self):
+        self.info = {}          # pid -> dict(TREE_ATTRS)
+        self.children = {}      # ppid -> [pid, ...]
+        for ps in psutil.process_iter(TREE_ATTRS):
+            info = ps.info
+            self.info[info['pid']] = info
+            self.children.setdefault(info['ppid'], []).append(info['pid'])
+
+    def __contains__(self, pid):
+        return pid in self.info
+
+    def descendants(self, pid):
+        out = []
+        seen = {pid}
+        stack = list(self.children.get(pid, []))
+        while stack:
+            child = stack.pop()
+            if child in seen:
+                continue
+            seen.add(child)
+            out.append(child)
+            stack.extend(self.children.get(child, []))
+        return out
+
+    def tree(self, pid):
+        # Processo seguito da tutti i discendenti
+        if pid not in self.info:
+            return []
+        return [pid] + self.descendants(pid)
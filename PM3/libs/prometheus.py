@@ -0,0 +1,71 @@
+import threading
+
+# Formato testuale di esposizione Prometheus (version 0.0.4)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(v):
+    return str(v).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + '}'
+
+
+def _value(v):
+    if v is None:
+        return 'NaN'
+    if isinstance(v, bool):
+        return '1' if v else '0'
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return str(v)
+
+
+def metric(name, mtype, mhelp, samples):
+    """
+    Blocco di testo per una metrica.
+    samples: lista di (labels, valore) oppure (suffisso, labels, valore)
+    """
+    out = [f'# HELP {name} {mhelp}', f'# TYPE {name} {mtype}']
+    for sample in samples:
+        if len(sample) == 3:
+            suffix, labels, v = sample
+        else:
+            suffix, (labels, v) = '', sample
+        out.append(f'{name}{suffix}{format_labels(labels)} {_value(v)}')
+    return '\n'.join(out) + '\n'
+
+
+class Histogram:
+    """Istogramma cumulativo per label (es. durata delle richieste per endpoint)."""
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.data = {}      # label -> [counts per bucket, count, sum]
+
+    def observe(self, label, v):
+        with self.lock:
+            d = self.data.get(label)
+            if d is None:
+                d = self.data[label] = [[0] * len(self.buckets), 0, 0.0]
+            for n, b in enumerate(self.buckets):
+                if v <= b:
+                    d[0][n] += 1
+            d[1] += 1
+            d[2] += v
+
+    def samples(self, label_name):
+        out = []
+        with self.lock:
+            for label, (counts, count, total) in sorted(self.data.items()):
+                for b, c in zip(self.buckets, counts):
+                    out.append(('_bucket', {label_name: label, 'le': b}, c))
+                out.append(('_bucket', {label_name: label, 'le': '+Inf'}, count))
+                out.append(('_count', {label_name: label}, count))
+                out.append(('_sum', {label_name: label}, total))
+        return out
@@ -0,0 +1,173 @@
+import os
+import time
+import threading
+import selectors
+import logging
+import psutil
+
+
+class Adopted:
+    """
+    Processo gestito gia' vivo all'avvio del backend ma non suo figlio
+    (sopravvissuto a un backend precedente). Se ne vede l'uscita ma non
+    l'exit code: returncode resta None.
+    """
+    def __init__(self, pid):
+        self.pid = pid
+        self.returncode = None
+        self.ps = psutil.Process(pid)
+
+    def exited(self):
+        try:
+            return not self.ps.is_running() or self.ps.status() == psutil.STATUS_ZOMBIE
+        except psutil.NoSuchProcess:
+            return True
+
+
+class Reaper(threading.Thread):
+    """
+    Reaping dei processi figli avviati dal backend.
+    Ogni processo registrato ha un pidfd nel selector: l'uscita viene
+    notificata dal kernel, senza polling periodico.
+    Se os.pidfd_open non e' disponibile (kernel < 5.3, non Linux)
+    si ripiega su un poll ogni poll_interval secondi.
+    """
+    def __init__(self, on_exit=None, poll_interval=1):
+        super().__init__(name='pm3_reaper', daemon=True)
+        self.on_exit = on_exit
+        self.poll_interval = poll_interval
+        self.use_pidfd = hasattr(os, 'pidfd_open')
+        self.selector = selectors.DefaultSelector()
+        self._lock = threading.Lock()
+        self._procs = {}        # pid -> (Popen, data)
+        self._pending = []      # Popen da registrare nel selector
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        self.selector.register(self._wake_r, selectors.EVENT_READ, None)
+
+    def register(self, popen, data=None):
+        with self._lock:
+            self._procs[popen.pid] = (popen, data)
+            self._pending.append(popen.pid)
+        os.write(self._wake_w, b'\0')
+
+    def adopt(self, pid, data=None):
+        """
+        Segue un processo non figlio (pidfd_open funziona su qualunque pid):
+        on_exit riceve un Adopted. Solleva psutil.NoSuchProcess se non c'e' piu'.
+        """
+        adopted = Adopted(pid)
+        self.register(adopted, data)
+        return adopted
+
+    def _drain_pending(self):
+        try:
+            while os.read(self._wake_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not self.use_pidfd:
+            return
+        for pid in pending:
+            try:
+                fd = os.pidfd_open(pid)
+            except ProcessLookupError:
+                # Gia' terminato e raccolto
+                self._reap(pid)
+                continue
+            except OSError:
+                # pidfd non supportati dal kernel: passo al polling
+                self.use_pidfd = False
+                return
+            self.selector.register(fd, selectors.EVENT_READ, pid)
+
+    def _reap(self, pid, fd=None):
+        if fd is not None:
+            self.selector.unregister(fd)
+            os.close(fd)
+        with self._lock:
+            popen, data = self._procs.get(pid, (None, None))
+        if popen is None:
+            return
+        if isinstance(popen, Adopted):
+            if not popen.exited():
+                return
+        elif popen.poll() is None:
+            return
+        with self._lock:
+            self._procs.pop(pid, None)
+        if self.on_exit:
+            try:
+                self.on_exit(popen, data)
+            except Exception as e:
+                logging.error(f'reaper on_exit error for pid {pid}: {e}')
+
+    def run(self):
+        while True:
+            events = self.selector.select(None if self.use_pidfd else self.poll_interval)
+            for key, _ in events:
+                if key.data is None:
+                    self._drain_pending()
+                else:
+                    self._reap(key.data, key.fd)
+
+            if not self.use_pidfd:
+                with self._lock:
+                    pids = list(self._procs)
+                for pid in pids:
+                    self._reap(pid)
+
+
+def wait_procs(procs, timeout=None, callback=None):
+    """
+    Come psutil.wait_procs ma senza polling: attende su un pidfd per
+    ogni processo e ritorna appena terminano tutti (o dopo timeout secondi).
+    I figli non vengono raccolti (ci pensa il Reaper), un processo
+    zombie conta come terminato.
+    callback(proc), se presente, viene chiamata all'uscita di ogni processo.
+    Restituisce (gone, alive).
+    """
+    fds = {}
+    gone = []
+    try:
+        for p in procs:
+            try:
+                fds[p] = os.pidfd_open(p.pid)
+            except ProcessLookupError:
+                gone.append(p)
+            except (AttributeError, OSError):
+                # pidfd non supportati (kernel < 5.3, non Linux): polling di psutil
+                for fd in fds.values():
+                    os.close(fd)
+                fds = {}
+                return psutil.wait_procs(procs, timeout=timeout, callback=callback)
+
+        for p in list(fds):
+            if not p.is_running():
+                # Il pid e' gia' stato riusato da un altro processo
+                os.close(fds.pop(p))
+                gone.append(p)
+        if callback:
+            for p in gone:
+                callback(p)
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with selectors.DefaultSelector() as selector:
+            for p, fd in fds.items():
+                selector.register(fd, selectors.EVENT_READ, p)
+            while fds:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                for key, _ in selector.select(remaining):
+                    selector.unregister(key.fd)
+                    os.close(fds.pop(key.data))
+                    gone.append(key.data)
+                    if callback:
+                        callback(key.data)
+        return gone, list(fds)
+    finally:
+        for fd in fds.values():
+            os.close(fd)
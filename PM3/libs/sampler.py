@@ -0,0 +1,144 @@
+import threading
+import logging
+import time
+import psutil
+from PM3.libs.proctree import ProcTree
+
+# Attributi raccolti ad ogni campione (connections e open_files
+# sono esclusi perche' sono le chiamate piu' costose di psutil)
+SAMPLE_ATTRS = ['cmdline', 'cpu_percent', 'cpu_times', 'create_time', 'cwd', 'exe', 'gids',
+                'io_counters', 'ionice', 'memory_info', 'memory_percent', 'name', 'num_fds',
+                'num_threads', 'pid', 'ppid', 'status', 'uids', 'username']
+# Attributi che /ps puo' chiedere con fields=: quelli del campione e quelli
+# costosi raccolti solo su richiesta (connections e' net_connections in psutil 6+)
+# (cpu_affinity, cpu_num e memory_maps non esistono su tutte le piattaforme)
+PS_ATTRS = frozenset(a for a in SAMPLE_ATTRS + [
+    'net_connections' if hasattr(psutil.Process, 'net_connections') else 'connections',
+    'cpu_affinity', 'cpu_num', 'environ', 'memory_full_info', 'memory_maps', 'nice',
+    'num_ctx_switches', 'open_files', 'terminal', 'threads'] if hasattr(psutil.Process, a))
+
+
+class Sampler(threading.Thread):
+    """
+    Campionamento periodico delle metriche dei processi gestiti
+    (processo principale e figli).
+    cpu_percent e' calcolata da psutil come delta tra due campioni
+    consecutivi dello stesso psutil.Process, senza sleep.
+    targets() deve restituire una lista di (pm3_id, pid).
+    on_sample(snapshot, ts), se presente, viene chiamata dopo ogni campione.
+    """
+    def __init__(self, targets, interval=2, on_sample=None):
+        super().__init__(name='pm3_sampler', daemon=True)
+        self.targets = targets
+        self.interval = interval
+        self.on_sample = on_sample
+        self.lock = threading.Lock()
+        self.snapshot = {}          # pm3_id -> [row, ...]
+        self.sampled_at = None
+        self.generation = 0
+        # Cambia solo quando cambia l'insieme dei (pm3_id, pid) vivi
+        self.liveness = 0
+        self._alive = frozenset()
+        self._ps_cache = {}         # pid -> psutil.Process
+
+    def _process(self, pid, create_time):
+        cached = self._ps_cache.get(pid)
+        if cached is not None and cached.create_time() == create_time:
+            # Stesso processo: tengo lo storico cpu
+            return cached
+        ps = psutil.Process(pid)
+        self._ps_cache[pid] = ps
+        return ps
+
+    def sample_tree(self, pid, tree, cache=False, seen=None, attrs=SAMPLE_ATTRS):
+        # seen (pid -> riga): pid gia' campionati in questo giro. Un pid puo'
+        # stare in piu' alberi (i processi gestiti sono anche figli del
+        # backend) e un secondo cpu_percent() a distanza di zero secondi da' 0.
+        # attrs: solo questi attributi (as_dict li legge in un solo oneshot())
+        rows = []
+        for child in tree.tree(pid):
+            if seen is not None and child in seen:
+                rows.append(seen[child])
+                continue
+            try:
+                if cache:
+                    ps = self._process(child, tree.info[child]['create_time'])
+                else:
+                    ps = psutil.Process(child)
+                row = ps.as_dict(attrs=attrs)
+            except psutil.NoSuchProcess:
+                continue
+            rows.append(row)
+            if seen is not None:
+                seen[child] = row
+        return rows
+
+    def sample(self):
+        # Una sola scansione di /proc per tutti i processi gestiti
+        tree = ProcTree()
+        snapshot = {}
+        sampled = {}
+        for pm3_id, pid in self.targets():
+            rows = self.sample_tree(pid, tree, cache=True, seen=sampled)
+            if rows:
+                snapshot[pm3_id] = rows
+
+        # Dimentico i processi non piu' presenti
+        seen = {row['pid'] for rows in snapshot.values() for row in rows}
+        for pid in list(self._ps_cache):
+            if pid not in seen:
+                del self._ps_cache[pid]
+
+        alive = frozenset((pm3_id, rows[0]['pid']) for pm3_id, rows in snapshot.items())
+        with self.lock:
+            self.snapshot = snapshot
+            self.sampled_at = time.time()
+            self.generation += 1
+            if alive != self._alive:
+                self._alive = alive
+                self.liveness += 1
+        if self.on_sample:
+            self.on_sample(snapshot, self.sampled_at)
+
+    @staticmethod
+    def collect(rows, attrs):
+        """
+        Copia delle righe di un campione con in piu' gli attributi attrs
+        (non campionati) letti ora; None se il processo non c'e' piu'.
+        """
+        out = []
+        for row in rows:
+            extra = None
+            try:
+                ps = psutil.Process(row['pid'])
+                # Pid riusato da un altro processo dopo il campione
+                if ps.create_time() == row['create_time']:
+                    extra = ps.as_dict(attrs=attrs)
+            except psutil.NoSuchProcess:
+                pass
+            if extra is None:
+                extra = dict.fromkeys(attrs)
+            out.append({**row, **extra})
+        return out
+
+    def get(self, pm3_id, pid):
+        """
+        Ultimo campione di pm3_id e la sua eta' in secondi,
+        (None, None) se il processo non e' ancora stato campionato
+        o ha cambiato pid.
+        """
+        with self.lock:
+            rows = self.snapshot.get(pm3_id)
+            sampled_at = self.sampled_at
+        if rows and rows[0]['pid'] == pid:
+            return rows, time.time() - sampled_at
+        return None, None
+
+    def run(self):
+        while True:
+            t0 = time.monotonic()
+            try:
+                self.sample()
+            except Exception as e:
+                logging.error(f'sampler error: {e}')
+            time.sleep(max(0, self.interval - (time.monotonic() - t0)))
@@ -20,3 +20,5 @@ class KillMsg(BaseModel):
     warn: bool = False
     gone: list = []
     alive: list = []
+    killed: bool = False                # terminato con SIGKILL dopo stop_timeout
+    elapsed: Union[float, None] = None  # secondi tra il segnale e l'uscita dell'ultimo processo
@@ -1,21 +1,33 @@
-from logging.handlers import RotatingFileHandler
-import threading, logging
 from pydantic import BaseModel, validator, root_validator
 from typing import Union
 import subprocess as sp
 import psutil
 import os
 from pathlib import Path
-import pendulum
 import signal
-from PM3.model.pm3_protocol import KillMsg, alive_gone
+import time
 
 # TODO: Trovare nomi milgiori
 
-def on_terminate(proc):
-    pass
-    #print(proc.status())
-    #print("process {} terminated with exit code {}".format(proc.pid, proc.returncode))
+def signal_name(sig):
+    # SIGTERM, TERM, term o 15 -> 'SIGTERM'
+    sig = str(sig).strip().upper()
+    try:
+        if sig.isdigit():
+            return signal.Signals(int(sig)).name
+        return signal.Signals[sig if sig.startswith('SIG') else f'SIG{sig}'].name
+    except (KeyError, ValueError):
+        raise ValueError(f'invalid signal {sig}')
+
+def _time_ago(create_time, now=None):
+    # pendulum serve solo qui: non lo importo per ogni uso dei modelli (cli)
+    import pendulum
+    now = now or pendulum.now()
+    return (now - pendulum.from_timestamp(create_time)).in_words()
+
+def _format_time(create_time):
+    # DD/MM/YYYY HH:mm:ss nell'ora locale
+    return time.strftime('%d/%m/%Y %H:%M:%S', time.localtime(create_time))
 
 
 class ProcessStatusLight(BaseModel):
@@ -50,18 +62,39 @@ class ProcessStatusLight(BaseModel):
 
     @root_validator(pre=True)
     def time_ago_generator(cls, values):
-        create_time = pendulum.from_timestamp(values['create_time'])
-        time_ago = pendulum.now() - create_time
-        values['time_ago'] = time_ago.in_words()
+        values['time_ago'] = _time_ago(values['create_time'])
         return values
 
     @validator('create_time')
     def create_time_formatter(cls, v, values, **kwargs):
         if isinstance(v, float):
-            v = pendulum.from_timestamp(v).astimezone().format('DD/MM/YYYY HH:mm:ss')
+            v = _format_time(v)
         return v
 
 
+# Campi di /ps usati dalla tabella di pm3 ps (time_ago e' calcolato)
+STATUS_LIGHT_FIELDS = tuple(f for f in ProcessStatusLight.__fields__ if f != 'time_ago')
+
+def status_light_rows(rows):
+    """Righe di ps formattate come ProcessStatusLight(**row).dict() ma
+    senza validazione: i dati arrivano dal backend e sono gia' validi.
+    """
+    import pendulum
+    now = pendulum.now()
+    fields = ProcessStatusLight.__fields__
+    out = []
+    for values in rows:
+        row = {k: values.get(k, f.default) for k, f in fields.items()}
+        row['memory_percent'] = round(row['memory_percent'], 2)
+        if isinstance(row['cmdline'], list):
+            row['cmdline'] = ' '.join(row['cmdline'])
+        row['time_ago'] = _time_ago(row['create_time'], now)
+        if isinstance(row['create_time'], float):
+            row['create_time'] = _format_time(row['create_time'])
+        out.append(row)
+    return out
+
+
 class ProcessStatus(BaseModel):
     cmdline: list
     connections: Union[list, None]
@@ -82,6 +115,9 @@ class ProcessStatus(BaseModel):
     status: str
     uids: list
     username: str
+    num_fds: Union[int, None]
+    num_threads: Union[int, None]
+    sample_age: Union[float, None]
 
     cmd: str
     interpreter: str
@@ -95,47 +131,12 @@ class ProcessStatus(BaseModel):
     autorun: bool
     nohup: bool
 
-class LogPipe(threading.Thread):
-
-    def __init__(self, filename, level = logging.DEBUG):
-        """Setup the object with a logger and a loglevel
-        and start the thread
-        """
-        # nuovo logger
-        from uuid import uuid4
-        logger = logging.getLogger( str(uuid4()))
-        handler = RotatingFileHandler(filename, maxBytes=1000*1000*30, backupCount=20)
-        logger.level = level
-        handler.level = level
-        logger.addHandler( handler )
-
-        threading.Thread.__init__(self)
-        self.daemon = False
-        self.level = level
-        self.logger = logger
-        self.fdRead, self.fdWrite = os.pipe()
-        self.pipeReader = os.fdopen(self.fdRead)
-
-        self.start()
-
-    def fileno(self):
-        """Return the write file descriptor of the pipe
-        """
-        return self.fdWrite
-
-    def run(self):
-        """Run the thread, logging everything.
-        """
-        for line in iter(self.pipeReader.readline, ''):
-            self.logger.log(self.level, line.strip('\n'))
-
-        self.pipeReader.close()
-
-    def close(self):
-        """Close the write end of the pipe.
-        """
-        os.close(self.fdWrite)
-
+    @root_validator(pre=True)
+    def connections_compat(cls, values):
+        # Da psutil 6 connections si chiama net_connections
+        if values.get('connections') is None and 'net_connections' in values:
+            values['connections'] = values['net_connections']
+        return values
 
 class ProcessList(BaseModel):
     # Utilizzata per mostrare i dati in formato tabellare
@@ -150,24 +151,33 @@ class ProcessList(BaseModel):
 
     @root_validator(pre=True)
     def _formatter(cls, values):
-        # Fromatting running
-        values['running'] = True if values['pid'] > 0 else False
-
-        # Formatting pid
-        values['pid'] = values['pid'] if values['pid'] > 0 else None
-
-        # Formatting restart
-        n_restart = values['restart'] if values['restart'] > 0 else 0
-        values['restart'] = f"{n_restart}/{values['max_restart']}"
-
-        # Formatting autorun
-        if values['autorun'] is False:
-            values['autorun'] = '[red]disabled[/red]'
-        elif values['autorun'] and values['autorun_exclude']:
-            values['autorun'] = '[yellow]suspended[/yellow]'
-        elif values['autorun'] and not values['autorun_exclude']:
-            values['autorun'] = '[green]enabled[/green]'
-        return values
+        return _list_format(values)
+
+
+def _list_format(values):
+    # Fromatting running
+    values['running'] = True if values['pid'] > 0 else False
+
+    # Formatting pid
+    values['pid'] = values['pid'] if values['pid'] > 0 else None
+
+    # Formatting restart
+    n_restart = values['restart'] if values['restart'] > 0 else 0
+    values['restart'] = f"{n_restart}/{values['max_restart']}"
+
+    # Formatting autorun
+    if values['autorun'] is False:
+        values['autorun'] = '[red]disabled[/red]'
+    elif values['autorun'] and values['autorun_exclude']:
+        values['autorun'] = '[yellow]suspended[/yellow]'
+    elif values['autorun'] and not values['autorun_exclude']:
+        values['autorun'] = '[green]enabled[/green]'
+    return values
+
+def list_row(values):
+    # Riga di ls formattata come ProcessList(**values).dict() ma senza validazione
+    values = _list_format(dict(values))
+    return {k: values.get(k, f.default) for k, f in ProcessList.__fields__.items()}
 
 
 class Process(BaseModel):
@@ -187,6 +197,13 @@ class Process(BaseModel):
     nohup: bool = False
     max_restart: int = 1000
     autorun_exclude = False
+    stop_signal: str = 'SIGTERM'    # segnale inviato allo stop
+    stop_timeout: Union[float, None] = None     # secondi prima di SIGKILL (None: default del backend)
+    stop_kill: bool = True          # dopo stop_timeout invia SIGKILL ai superstiti
+    # Rotazione dei log catturati (None: default del backend)
+    log_max_mb: Union[float, None] = None       # dimensione oltre la quale ruotare, 0 mai
+    log_backups: Union[int, None] = None        # file ruotati da tenere
+    log_compress: Union[bool, None] = None      # comprimere i file ruotati
 
     @root_validator
     def _formatter(cls, values):
@@ -206,6 +223,9 @@ class Process(BaseModel):
         if values['max_restart'] is None or values['max_restart'] < 1:
             values['max_restart'] = 1000
 
+        # Stop signal
+        values['stop_signal'] = signal_name(values['stop_signal'])
+
         return values
 
     @property
@@ -243,16 +263,23 @@ class Process(BaseModel):
             return ProcessStatus(**psutil.Process(self.pid).as_dict())
 
     @staticmethod
-    def kill_proc_tree(pid, sig=signal.SIGTERM, include_parent=True,
-                       timeout=5, on_terminate=on_terminate):
-        """Kill a process tree (including grandchildren) with signal
-        "sig" and return a (gone, still_alive) tuple.
-        "on_terminate", if specified, is a callback function which is
-        called as soon as a child terminates.
+    def signal_proc_tree(pid, sig=signal.SIGTERM, include_parent=True, tree=None):
+        """Send signal "sig" to a process tree (including grandchildren)
+        without waiting and return the list of signalled psutil.Process.
+        "tree", if specified, is a ProcTree snapshot used to find the
+        children instead of scanning /proc again.
         """
         parent = psutil.Process(pid)
         # Kill Parent and Children
-        children = parent.children(recursive=True)
+        if tree is not None and pid in tree:
+            children = []
+            for child in tree.descendants(pid):
+                try:
+                    children.append(psutil.Process(child))
+                except psutil.NoSuchProcess:
+                    pass
+        else:
+            children = parent.children(recursive=True)
         if include_parent:
             children.append(parent)
 
@@ -261,36 +288,20 @@ class Process(BaseModel):
                 p.send_signal(sig)
             except psutil.NoSuchProcess:
                 pass
-        try:
-            gone, alive = psutil.wait_procs(children, timeout=timeout,
-                                            callback=on_terminate)
-        except psutil.NoSuchProcess:
-            gone = [alive_gone(pid=pid),]
-            alive = []
+        return children
 
-        return (gone, alive)
+    @property
+    def log_max_bytes(self):
+        return None if self.log_max_mb is None else int(self.log_max_mb * 1024 ** 2)
 
-    def kill(self):
-        if self.pid == -1:
-            return KillMsg(msg='NOT RUNNING', warn=True)
-        try:
-            psutil.Process(self.pid)
-        except psutil.NoSuchProcess:
-            return KillMsg(msg='NO SUCH PROCESS', warn=True)
+    @property
+    def stop_signum(self):
+        return signal.Signals[self.stop_signal]
 
-        gone, alive = self.kill_proc_tree(self.pid)
-        if len(alive) > 0:
-            return KillMsg(msg='OK', alive=alive, gone=gone, warn=True)
-        else:
-            self.pid = -1
-            return KillMsg(msg='OK', alive=alive, gone=gone)
-
-    def run(self):
-        #fErrHandler = RotatingFileHandler(self.stderr, maxBytes=1000*1000*10, backupCount=5)
-        #fout = LogPipe(self.stderr)
-        #ferr = LogPipe(self.stdout)
-        fout = open(self.stdout, 'a')
-        ferr = open(self.stderr, 'a')
+    def run(self, log_capture=None):
+        # log_capture (LogCapture): stdout e stderr passano da una pipe letta
+        # dal backend. I processi nohup scrivono direttamente sui file,
+        # cosi' sopravvivono al backend
         if isinstance(self.cmd, list):
             cmd = self.cmd
         elif isinstance(self.cmd, str):
@@ -301,6 +312,28 @@ class Process(BaseModel):
         if Path(self.interpreter).is_file():
             cmd.insert(0, self.interpreter)
 
+        files = []
+        try:
+            for path in (self.stdout, self.stderr):
+                if log_capture is None or self.nohup:
+                    files.append(open(path, 'a'))
+                else:
+                    files.append(log_capture.pipe(path, max_bytes=self.log_max_bytes,
+                                                  backup_count=self.log_backups, compress=self.log_compress))
+            p = self._popen(cmd, *files)
+        finally:
+            # Il figlio ha i suoi descrittori: chiudo quelli del backend
+            for f in files:
+                if isinstance(f, int):
+                    os.close(f)
+                else:
+                    f.close()
+        self.pid = p.pid
+        self.restart += 1
+        self.autorun_exclude = False
+        return p
+
+    def _popen(self, cmd, fout, ferr):
         if self.nohup:
             print("starting with nohup")
             if 'nohup' not in cmd[0]:
@@ -321,10 +354,36 @@ class Process(BaseModel):
                          stdout=fout,
                          stderr=ferr,
                          bufsize=0)
-        self.pid = p.pid
-        self.restart += 1
-        self.autorun_exclude = False
         return p
 
     def reset(self):
-        self.restart = 0
\ No newline at end of file
+        self.restart = 0
+
+
+class ProcessRecord:
+    """Riga del registro in sola lettura per i percorsi caldi (ls, ps, ...).
+
+    Le righe sono validate da Process una sola volta, quando entrano nel
+    registro: qui non si rivalida nulla. Espone gli stessi attributi di
+    Process e i suoi metodi di sola lettura; to_process() per start, stop
+    e reset.
+    """
+    __slots__ = tuple(Process.__fields__)
+
+    def __init__(self, row):
+        for k in self.__slots__:
+            setattr(self, k, row[k])
+
+    def dict(self):
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    def to_process(self):
+        return Process.construct(**self.dict())
+
+    is_running = Process.is_running
+    ps = Process.ps
+    log_max_bytes = Process.log_max_bytes
+    stop_signum = Process.stop_signum
+
+    def __repr__(self):
+        return f'ProcessRecord(pm3_id={self.pm3_id}, pm3_name={self.pm3_name!r}, pid={self.pid})'
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Load test del backend: server di sviluppo Flask contro server di produzione.
+
+    python -m benchmarks.bench_http [--clients 16] [--duration 10] [--procs 50]
+
+Per ogni modalita' avvia un backend in una home temporanea, crea --procs
+processi (meta' avviati), poi --clients thread eseguono in loop
+/ping, /ls/all, /ps/all e /start/<id> per --duration secondi.
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from configparser import ConfigParser
+from pathlib import Path
+
+import requests
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _start_backend(home, server, **backend):
+    # backend: opzioni in piu' della sezione [backend] (es. sample_interval)
+    port = _free_port()
+    pm3_home = Path(home, '.pm3')
+    (pm3_home / 'log').mkdir(parents=True, exist_ok=True)
+    config = ConfigParser()
+    config['main_section'] = {'pm3_home_dir': pm3_home,
+                              'pm3_db': f'{pm3_home}/pm3_db.json',
+                              'pm3_db_process_table': 'pm3_procs',
+                              'main_interpreter': sys.executable}
+    config['backend'] = {'name': '__backend__', 'cmd': '', 'url': f'http://127.0.0.1:{port}/', 'server': server,
+                         **backend}
+    config['cron_checker'] = {'name': '__cron_checker__', 'cmd': '', 'enabled': False, 'sleep_time': 5}
+    with open(pm3_home / 'config.ini', 'w') as f:
+        config.write(f)
+
+    # Il backend usa il PM3 di questo checkout anche se non e' installato
+    repo = Path(__file__).resolve().parents[1].as_posix()
+    env = {**os.environ, 'HOME': home, 'PYTHONPATH': os.pathsep.join([repo, os.environ.get('PYTHONPATH', '')])}
+    p = subprocess.Popen([sys.executable, '-c', 'from PM3.app import main; main()'], env=env,
+                         cwd=home, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    for _ in range(100):
+        try:
+            requests.get(f'{url}/ping', timeout=1)
+            break
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.1)
+    return p, url
+
+
+def _load(url, clients, duration, n_procs):
+    paths = ['ping', 'ls/all', 'ps/all', f'start/{n_procs // 2}']
+    latencies = {i: [] for i in paths}
+    errors = []
+    deadline = time.monotonic() + duration
+
+    def worker(n):
+        session = requests.Session()
+        i = n
+        while time.monotonic() < deadline:
+            path = paths[i % len(paths)]
+            i += 1
+            t0 = time.perf_counter()
+            try:
+                r = session.get(f'{url}/{path}', timeout=30)
+                r.raise_for_status()
+            except requests.exceptions.RequestException as e:
+                errors.append(e)
+                continue
+            latencies[path].append(time.perf_counter() - t0)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, errors
+
+
+def _pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000 if values else float('nan')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--procs', type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{'server':<12} {'endpoint':<12} {'req':>7} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for server in ('development', 'production'):
+        with tempfile.TemporaryDirectory() as home:
+            backend, url = _start_backend(home, server)
+            try:
+                for n in range(1, args.procs + 1):
+                    requests.post(f'{url}/new', json={'pm3_name': f'sleep_{n}', 'cmd': '/bin/sleep 600'})
+                    if n % 2:
+                        requests.get(f'{url}/start/{n}')
+                latencies, errors = _load(url, args.clients, args.duration, args.procs)
+                requests.get(f'{url}/stop/all')
+            finally:
+                backend.terminate()
+                backend.wait()
+
+        total = sum(len(v) for v in latencies.values())
+        everything = [i for v in latencies.values() for i in v]
+        for path, values in latencies.items():
+            name = path.split('/')[0]
+            print(f'{server:<12} {name:<12} {len(values):>7} {len(values) / args.duration:>8.1f} '
+                  f'{_pct(values, 0.5):>8.2f} {_pct(values, 0.99):>8.2f} {"":>7}')
+        print(f'{server:<12} {"total":<12} {total:>7} {total / args.duration:>8.1f} '
+              f'{_pct(everything, 0.5):>8.2f} {_pct(everything, 0.99):>8.2f} {len(errors):>7}')
+
+
+if __name__ == '__main__':
+    main()
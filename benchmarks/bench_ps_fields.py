@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Dimensione e latenza di /ps/all con e senza la proiezione dei campi.
+
+    python -m benchmarks.bench_ps_fields [--procs 200] [--requests 50]
+
+Avvia un backend in una home temporanea con --procs processi avviati e
+chiede /ps/all con: tutti i campi, le colonne della tabella di pm3 ps,
+tre metriche e tre metriche piu' open_files (non campionato, letto ad
+ogni richiesta). Due scenari: righe dal campione del sampler
+(sample_interval = 1) e raccolta ad ogni richiesta (sampler fermo dopo
+il primo giro, sample_interval = 3600), dove fields= riduce anche gli
+attributi letti da psutil.
+"""
+import argparse
+import statistics
+import tempfile
+import time
+
+import requests
+
+from PM3.model.process import STATUS_LIGHT_FIELDS
+from benchmarks.bench_http import _start_backend
+
+MODES = [('all fields', None),
+         ('table columns', ','.join(STATUS_LIGHT_FIELDS)),
+         ('3 metrics', 'pid,cpu_percent,memory_percent'),
+         ('3 + open_files', 'pid,cpu_percent,memory_percent,open_files')]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--procs', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{'rows from':<9} {'fields':<15} {'bytes':>9} {'mean ms':>8} {'p50 ms':>8} {'max ms':>8}")
+    for scenario, sample_interval in (('sampler', 1), ('live', 3600)):
+        with tempfile.TemporaryDirectory() as home:
+            backend, url = _start_backend(home, 'production', sample_interval=sample_interval)
+            session = requests.Session()
+            try:
+                session.post(f'{url}/new/bulk', json=[{'pm3_name': f'sleep_{n}', 'cmd': '/bin/sleep 600'}
+                                                      for n in range(args.procs)])
+                session.get(f'{url}/start/all', timeout=60)
+                time.sleep(2 * sample_interval if sample_interval < 10 else 0)
+                for name, fields in MODES:
+                    params = {'fields': fields} if fields else None
+                    times, size = [], 0
+                    for _ in range(args.requests):
+                        t0 = time.perf_counter()
+                        r = session.get(f'{url}/ps/all', params=params, timeout=60)
+                        times.append(time.perf_counter() - t0)
+                        size = len(r.content)
+                        assert not r.json()['err'], r.json()['msg']
+                    print(f'{scenario:<9} {name:<15} {size:>9} {statistics.mean(times) * 1000:>8.2f} '
+                          f'{statistics.median(times) * 1000:>8.2f} {max(times) * 1000:>8.2f}')
+                session.get(f'{url}/stop/all', timeout=60)
+            finally:
+                backend.terminate()
+                backend.wait()
+
+
+if __name__ == '__main__':
+    main()
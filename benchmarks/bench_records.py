@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Costo per riga delle letture del registro: modelli pydantic contro
+ProcessRecord e formattazione senza validazione.
+
+    python -m benchmarks.bench_records [--rows 1000] [--repeat 5]
+
+Backend:
+  - row: una riga del registro -> Process(**row), Process.construct, ProcessRecord
+  - find: find_id_or_name('all') con Process(**row) per riga (prima) e con ProcessRecord
+  - ls: payload di /ls, RetMsg con i Process contro RetMsg con i dict dei record
+Cli:
+  - ls: ProcessList(**row).dict() contro list_row()
+  - ps: ProcessStatusLight(**row).dict() contro status_light_rows()
+"""
+import argparse
+import os
+import time
+
+import psutil
+
+from PM3.libs.pm3table import Pm3Table
+from PM3.model.pm3_protocol import RetMsg
+from PM3.model.process import (Process, ProcessRecord, ProcessList, ProcessStatusLight,
+                               list_row, status_light_rows)
+
+
+class _MemStore:
+    # Store minimo in memoria: qui interessa solo il costo delle letture
+    def __init__(self, rows):
+        self._rows = rows
+
+    def all(self):
+        return self._rows
+
+    def write(self, rows, deleted):
+        pass
+
+
+def _timeit(fn, n, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best / n * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    n = args.rows
+
+    rows = [Process(pm3_id=i, pm3_name=f'proc_{i}', cmd=f'/bin/sleep {i}', autorun=i % 2 == 0).dict()
+            for i in range(1, n + 1)]
+    ptbl = Pm3Table(_MemStore(rows))
+    me = psutil.Process().as_dict()
+    me.pop('environ', None)
+    ps_rows = [{**row, **me, 'pid': os.getpid(), 'sample_age': 0.0} for row in rows]
+
+    cases = [
+        ('backend row', 'Process(**row)', lambda: [Process(**r) for r in rows]),
+        ('backend row', 'Process.construct', lambda: [Process.construct(**r) for r in rows]),
+        ('backend row', 'ProcessRecord', lambda: [ProcessRecord(r) for r in rows]),
+        ('backend find all', 'Process(**row)', lambda: [Process(**r) for r in ptbl.rows()]),
+        ('backend find all', 'ProcessRecord', lambda: ptbl.find_id_or_name('all')),
+        ('backend ls payload', 'Process', lambda: RetMsg(msg='OK', payload=[Process(**r) for r in rows]).dict()),
+        ('backend ls payload', 'ProcessRecord', lambda: RetMsg(msg='OK', payload=[ProcessRecord(r).dict() for r in rows]).dict()),
+        ('cli ls row', 'ProcessList', lambda: [ProcessList(**r).dict() for r in rows]),
+        ('cli ls row', 'list_row', lambda: [list_row(r) for r in rows]),
+        ('cli ps row', 'ProcessStatusLight', lambda: [ProcessStatusLight(**r).dict() for r in ps_rows]),
+        ('cli ps row', 'status_light_rows', lambda: status_light_rows(ps_rows)),
+    ]
+
+    # Stesso risultato con e senza validazione
+    assert [list_row(r) for r in rows] == [ProcessList(**r).dict() for r in rows]
+    assert ProcessRecord(rows[0]).dict() == Process(**rows[0]).dict()
+
+    print(f'{n} rows, best of {args.repeat}')
+    print(f"{'path':<20} {'how':<20} {'us/row':>8}")
+    for path, how, fn in cases:
+        print(f'{path:<20} {how:<20} {_timeit(fn, n, args.repeat):>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Tempo di avvio della cli: import dei moduli e comandi completi.
+
+    python -m benchmarks.bench_startup [--runs 10] [--procs 20] [--top 10]
+
+Con python -X importtime misura l'import di PM3.cli e mostra i moduli
+piu' costosi, poi avvia un backend in una home temporanea con --procs
+processi e misura il tempo totale (processo python compreso) di
+pm3 ping, pm3 ls e pm3 ls -j.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import requests
+
+from benchmarks.bench_http import _start_backend
+
+REPO = Path(__file__).resolve().parents[1].as_posix()
+
+
+def _env(home):
+    return {**os.environ, 'HOME': home, 'PYTHONPATH': os.pathsep.join([REPO, os.environ.get('PYTHONPATH', '')])}
+
+
+def _importtime(env, top):
+    # Righe "import time: self | cumulative | modulo" (microsecondi) in ordine
+    # di fine import: i moduli importati da PM3.cli la precedono, indentati
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import PM3.cli'], env=env,
+                         stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, text=True).stderr
+    rows = []
+    for line in out.splitlines():
+        parts = line.split('|')
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            name = parts[2].rstrip()
+            rows.append((int(parts[1]), len(name) - len(name.lstrip()), name.strip()))
+    end = next(i for i, (_, _, name) in enumerate(rows) if name == 'PM3.cli')
+    total, depth, _ = rows[end]
+    children = []
+    for us, d, name in reversed(rows[:end]):
+        if d <= depth:
+            break
+        if d == depth + 2:
+            children.append((us, name))
+    return total, sorted(children, reverse=True)[:top]
+
+
+def _wall(cmd, env, runs):
+    times = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        subprocess.run(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - t0)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--procs', type=int, default=20)
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as home:
+        env = _env(home)
+        total, heavy = _importtime(env, args.top)
+        print(f'import PM3.cli: {total / 1000:.1f} ms')
+        for us, name in heavy:
+            print(f'  {us / 1000:>8.1f} ms  {name}')
+        print()
+
+        backend, url = _start_backend(home, 'production')
+        try:
+            for n in range(1, args.procs + 1):
+                requests.post(f'{url}/new', json={'pm3_name': f'sleep_{n}', 'cmd': '/bin/sleep 600'})
+            cli = [sys.executable, '-m', 'PM3.cli']
+            print(f"{'command':<16} {'min ms':>8} {'median ms':>10} {'max ms':>8}")
+            for name, cmd in (('python', [sys.executable, '-c', 'pass']),
+                              ('pm3 ping', cli + ['ping']),
+                              ('pm3 ls', cli + ['ls']),
+                              ('pm3 ls -j', cli + ['ls', '-j'])):
+                times = _wall(cmd, env, args.runs)
+                print(f'{name:<16} {min(times) * 1000:>8.1f} {statistics.median(times) * 1000:>10.1f} '
+                      f'{max(times) * 1000:>8.1f}')
+        finally:
+            backend.terminate()
+            backend.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Confronto tra gli storage engine di Pm3Table (TinyDB json e SQLite WAL).
+
+    python -m benchmarks.bench_storage [--sizes 100 1000 10000]
+
+Per ogni dimensione misura:
+  - load: apertura dello store e caricamento del registro
+  - point: flush di una sola riga modificata (es. cambio pid)
+  - bulk: flush di tutte le righe modificate
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from PM3.libs.pm3store import TinyDBStore, SQLiteStore
+from PM3.libs.pm3table import Pm3Table
+from PM3.model.process import Process
+
+
+def _rows(n):
+    return [Process(pm3_id=i, pm3_name=f'proc_{i}', cmd=f'/bin/sleep {i}', autorun=i % 2 == 0).dict()
+            for i in range(1, n + 1)]
+
+
+def _timeit(fn, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+def bench(engine, n, workdir):
+    if engine == 'tinydb':
+        make = lambda: TinyDBStore(Path(workdir, f'db_{n}.json'), 'pm3_procs')
+    else:
+        make = lambda: SQLiteStore(Path(workdir, f'db_{n}.sqlite'), 'pm3_procs')
+
+    make().write(_rows(n), [])
+    ptbl = Pm3Table(make())
+    load = _timeit(lambda: Pm3Table(make()))
+
+    procs = ptbl.find_id_or_name('ALL').proc
+    counter = iter(range(10 ** 9))
+
+    def point():
+        p = procs[n // 2]
+        p.pid = next(counter)
+        ptbl.update(p)
+        ptbl.flush()
+
+    def bulk():
+        pid = next(counter)
+        for p in procs:
+            p.pid = pid
+            ptbl.update(p)
+        ptbl.flush()
+
+    return load, _timeit(point, repeat=20), _timeit(bulk, repeat=3)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', nargs='+', type=int, default=[100, 1000, 10000])
+    args = parser.parse_args()
+
+    print(f"{'engine':<8} {'rows':>7} {'load ms':>10} {'point ms':>10} {'bulk ms':>10}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for n in args.sizes:
+            for engine in ('tinydb', 'sqlite'):
+                load, point, bulk = bench(engine, n, workdir)
+                print(f'{engine:<8} {n:>7} {load:>10.2f} {point:>10.3f} {bulk:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
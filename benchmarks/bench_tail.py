@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Tail di file di log molto grandi: PM3.libs.logtail.tail contro readlines().
+
+    python -m benchmarks.bench_tail [--sizes 1 10] [--lines 10 1000] [--dir /tmp] [--readlines]
+
+Per ogni dimensione (in GB) genera un file di log, poi misura tempo e
+picco di memoria (tracemalloc) per leggere le ultime --lines righe.
+readlines() carica tutto il file in memoria: viene eseguito solo con
+--readlines e solo per i file fino a 1 GB.
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from PM3.libs.logtail import tail
+
+GB = 1024 ** 3
+
+
+def _make_log(path, size):
+    line = b'2022-01-01 00:00:00,000 INFO worker[1234] processed request id=%08d in 12.3 ms\n'
+    block = b''.join(line % i for i in range(16384))
+    with open(path, 'wb') as f:
+        written = 0
+        while written < size:
+            written += f.write(block)
+
+
+def _measure(fn):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    out = fn()
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return out, elapsed * 1000, peak / 1024 ** 2
+
+
+def _readlines(path, n):
+    with open(path, 'r') as f:
+        return f.readlines()[-n:]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=float, nargs='+', default=[1, 10])
+    parser.add_argument('--lines', type=int, nargs='+', default=[10, 1000])
+    parser.add_argument('--dir', default=None, help='where to create the log files')
+    parser.add_argument('--readlines', action='store_true', help='also run readlines() (<= 1 GB)')
+    args = parser.parse_args()
+
+    print(f"{'size':>7} {'lines':>6} {'method':<10} {'ms':>10} {'peak MB':>10}")
+    with tempfile.TemporaryDirectory(dir=args.dir) as workdir:
+        for size in args.sizes:
+            path = os.path.join(workdir, f'bench_{size}g.log')
+            _make_log(path, int(size * GB))
+            for n in args.lines:
+                out, ms, peak = _measure(lambda: tail(path, n))
+                print(f'{size:>6g}G {n:>6} {"tail":<10} {ms:>10.2f} {peak:>10.2f}')
+                if args.readlines and size <= 1:
+                    expected, ms, peak = _measure(lambda: _readlines(path, n))
+                    assert out == expected
+                    print(f'{size:>6g}G {n:>6} {"readlines":<10} {ms:>10.2f} {peak:>10.2f}')
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
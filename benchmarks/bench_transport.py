@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Latenza di andata e ritorno cli <-> backend per trasporto.
+
+    python -m benchmarks.bench_transport [--requests 2000] [--path ping]
+
+Avvia un backend (server di produzione) in una home temporanea e misura
+--requests chiamate sequenziali a --path con:
+requests.get (una connessione tcp per chiamata, la vecchia cli),
+PM3.libs.client.Client su tcp e su socket unix, con una connessione
+nuova per chiamata e con le connessioni riusate (keep-alive).
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import requests
+
+from PM3.libs.client import Client
+from benchmarks.bench_http import _start_backend
+
+
+def _run(call, n):
+    times = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        call()
+        times.append(time.perf_counter() - t0)
+    return times
+
+
+def _pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--path', default='ping')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as home:
+        backend, url = _start_backend(home, 'production')
+        sock = Path(home, '.pm3', 'pm3.sock').as_posix()
+        try:
+            for _ in range(50):
+                if os.path.exists(sock):
+                    break
+                time.sleep(0.1)
+            cases = [('requests tcp', 'new', lambda: requests.get(f'{url}/{args.path}', timeout=5).json())]
+            for transport, unix_socket in (('tcp', None), ('unix', sock)):
+                for mode, pool_size in (('new', 0), ('pooled', 4)):
+                    client = Client(url, unix_socket=unix_socket, pool_size=pool_size)
+                    assert client.transport == transport
+                    cases.append((f'client {transport}', mode, lambda c=client: c.get(args.path)))
+
+            print(f"{'transport':<14} {'conn':<7} {'req/s':>8} {'mean ms':>8} {'p50 ms':>8} {'p99 ms':>8}")
+            for name, mode, call in cases:
+                _run(call, min(100, args.requests))     # warm-up
+                times = _run(call, args.requests)
+                print(f'{name:<14} {mode:<7} {len(times) / sum(times):>8.0f} {statistics.mean(times) * 1000:>8.3f} '
+                      f'{_pct(times, 0.5):>8.3f} {_pct(times, 0.99):>8.3f}')
+        finally:
+            backend.terminate()
+            backend.wait()
+
+
+if __name__ == '__main__':
+    main()